@@ -1,10 +1,19 @@
+import argparse
 import os
 import yaml
 from pathlib import Path
+from src.distilled_model import train_distilled_model
+from src.embedding_store import extract_embeddings
 from src.extract_comments import process_folder
 from src.process_comments import process_comments_data
-from src.sentiment_analysis import process_excel
-from src.sentiment_analysis_compare import compare_models
+from src.sentiment_analysis import merge_sentiment_shards, process_excel
+from src.sentiment_analysis_compare import compare_models, evaluate_cascade, merge_comparison_shards
+from src.output_writer import resolve_output_path, write_table
+from src.pipeline import Pipeline, Stage
+from src.progressive_estimate import estimate_sentiment
+from src.sentiment_cube import update_sentiment_cube
+from src.sentiment_timeseries import build_sentiment_timeseries
+from src.sharding import parse_shard, shard_path
 
 def load_config():
     """加载配置文件并处理路径"""
@@ -22,54 +31,398 @@ def load_config():
     return config
 
 
+def error_log_path(config, stage_name, shard=None):
+    """每个步骤（及每个分片）使用单独的错误日志，避免并行执行的步骤互相覆盖"""
+    if not config.get('error_log_file'):
+        return None
+    stem, ext = os.path.splitext(config['error_log_file'])
+    path = f"{stem}_{stage_name}{ext}"
+    return shard_path(path, shard) if shard else path
+
+
+def checkpoint_path(config, stage_name, shard=None):
+    """步骤（及分片）的检查点文件路径，未配置检查点目录时返回None"""
+    checkpoint_dir = config.get('checkpoint_dir')
+    if not checkpoint_dir:
+        return None
+    path = os.path.join(checkpoint_dir, f"{stage_name}.csv")
+    return shard_path(path, shard) if shard else path
+
+
+def output_paths(config):
+    """根据输出格式配置计算各步骤实际读写的文件路径"""
+    output_config = config.get('output', {})
+    return {
+        'raw_comments': resolve_output_path(config['raw_comments_file'], 'raw_comments', output_config),
+        'processed_comments': resolve_output_path(
+            config['processed_comments_file'], 'processed_comments', output_config
+        ),
+        'sentiment_output': resolve_output_path(config['sentiment_output_file'], 'sentiment_output', output_config),
+        'model_comparison': resolve_output_path(
+            config.get('comparison_output_file', '模型对比结果.xlsx'), 'model_comparison', output_config
+        ),
+        'cascade_evaluation': resolve_output_path(
+            config.get('cascade_evaluation_file', '级联打分评估.xlsx'), 'cascade_evaluation', output_config
+        ),
+        'sentiment_cube': resolve_output_path(
+            config.get('sentiment_cube', {}).get('cube_file', '情感立方体.xlsx'), 'sentiment_cube', output_config
+        ),
+        'sentiment_timeseries': resolve_output_path(
+            config.get('sentiment_timeseries', {}).get('output_file', '情感时间序列.xlsx'), 'sentiment_timeseries',
+            output_config
+        ),
+        'sentiment_estimate': resolve_output_path(
+            config.get('approximate', {}).get('output_file', '情感近似估计.xlsx'), 'sentiment_estimate', output_config
+        ),
+        'distillation_report': resolve_output_path(
+            config.get('distillation', {}).get('report_file', '蒸馏模型评估.xlsx'), 'distillation_report', output_config
+        ),
+    }
+
+
+def run_extract(config):
+    """步骤1: 提取评论"""
+    raw_comments = process_folder(config['input_folder'], skip_failed=config.get('skip_failed_files', False))
+    if raw_comments is None:
+        print("评论提取失败")
+        return False
+    raw_comments_file = output_paths(config)['raw_comments']
+    write_table(raw_comments, raw_comments_file, 'raw_comments', config.get('output', {}))
+    print(f"原始评论已保存至：{raw_comments_file}")
+    return True
+
+
+def run_process(config):
+    """步骤2: 处理评论数据"""
+    paths = output_paths(config)
+    processed_df = process_comments_data(
+        paths['raw_comments'],
+        paths['processed_comments'],
+        config['ip_address_file'],
+        output_config=config.get('output', {}),
+        sticker_features=config.get('sticker_features', False)
+    )
+    return processed_df is not None
+
+
+def run_sentiment(config, resume=False, shard=None):
+    """步骤3: 情感分析（指定shard时只对该分片打分）"""
+    sentiment_result = process_excel(
+        output_paths(config)['processed_comments'],
+        "评论内容",
+        config['sentiment_output_file'],
+        output_config=config.get('output', {}),
+        snownlp_backend=config.get('snownlp_backend', 'batch'),
+        processes=config.get('snownlp_processes', 1),
+        checkpoint_file=checkpoint_path(config, 'sentiment', shard),
+        checkpoint_every=config.get('checkpoint_every', 1000),
+        resume=resume,
+        error_log_file=error_log_path(config, 'sentiment', shard),
+        scoring_mode=config.get('scoring_mode', 'snownlp'),
+        cascade_config=config.get('cascade', {}),
+        token_cache_dir=config.get('token_cache_dir'),
+        batch_size=config.get('transformer_batch_size', 32),
+        shard=shard,
+        shard_key=config.get('shard_key', 'fingerprint'),
+        distilled_model_file=config.get('distillation', {}).get('model_file', './.cache/distilled_model.joblib')
+    )
+    return sentiment_result is not None
+
+
+def run_estimate(config):
+    """渐进式近似估计每个视频的平均情感得分，达到精度的视频提前停止打分"""
+    approximate_config = config.get('approximate', {})
+    estimates = estimate_sentiment(
+        output_paths(config)['processed_comments'],
+        "评论内容",
+        approximate_config.get('output_file', '情感近似估计.xlsx'),
+        output_config=config.get('output', {}),
+        precision=approximate_config.get('precision', 0.01),
+        confidence=approximate_config.get('confidence', 0.95),
+        batch_size=approximate_config.get('batch_size', 200),
+        min_samples=approximate_config.get('min_samples', 30),
+        random_state=approximate_config.get('random_state', 42),
+        scoring_mode=config.get('scoring_mode', 'snownlp'),
+        processes=config.get('snownlp_processes', 1),
+        distilled_model_file=config.get('distillation', {}).get('model_file', './.cache/distilled_model.joblib')
+    )
+    return estimates is not None
+
+
+def run_sentiment_cube(config):
+    """步骤4: 把新打分的评论增量累加到情感立方体"""
+    cube_config = config.get('sentiment_cube', {})
+    cube = update_sentiment_cube(
+        output_paths(config)['sentiment_output'],
+        cube_config.get('cube_file', '情感立方体.xlsx'),
+        cube_config.get('keys_file', './.cache/sentiment_cube_keys.bin'),
+        output_config=config.get('output', {}),
+        rebuild=cube_config.get('rebuild', False),
+        bins=cube_config.get('bins', 10)
+    )
+    return cube is not None
+
+
+def run_sentiment_timeseries(config):
+    """步骤5: 生成每个视频的逐日情感时间序列"""
+    timeseries_config = config.get('sentiment_timeseries', {})
+    result = build_sentiment_timeseries(
+        output_paths(config)['sentiment_output'],
+        timeseries_config.get('output_file', '情感时间序列.xlsx'),
+        output_config=config.get('output', {}),
+        windows=timeseries_config.get('windows', [7, 30]),
+        halflife=timeseries_config.get('halflife', 7),
+        incremental=timeseries_config.get('incremental', True),
+        keys_file=timeseries_config.get('keys_file', './.cache/sentiment_timeseries_keys.bin')
+    )
+    return result is not None
+
+
+def run_comparison(config, resume=False, shard=None):
+    """步骤6: 模型对比（指定shard时只分析该分片）"""
+    compare_models(
+        output_paths(config)['processed_comments'],
+        text_column='评论内容',
+        sample_size=config.get('comparison_sample_size', 100),
+        output_file=config.get('comparison_output_file', '模型对比结果.xlsx'),
+        output_config=config.get('output', {}),
+        token_cache_dir=config.get('token_cache_dir'),
+        batch_size=config.get('transformer_batch_size', 32),
+        random_state=config.get('comparison_random_state'),
+        checkpoint_file=checkpoint_path(config, 'comparison', shard),
+        checkpoint_every=config.get('checkpoint_every', 1000),
+        resume=resume,
+        error_log_file=error_log_path(config, 'comparison', shard),
+        shard=shard,
+        shard_key=config.get('shard_key', 'fingerprint'),
+        distilled_model_file=config.get('distillation', {}).get('model_file', './.cache/distilled_model.joblib')
+    )
+    return True
+
+
+def merge_stage_shards(config, stage_name, shard_count):
+    """合并情感分析或模型对比的分片结果"""
+    paths = output_paths(config)
+    if stage_name == 'sentiment':
+        merged = merge_sentiment_shards(
+            paths['processed_comments'], "评论内容", config['sentiment_output_file'], shard_count,
+            output_config=config.get('output', {})
+        )
+        return merged is not None
+    try:
+        merge_comparison_shards(
+            paths['processed_comments'], shard_count,
+            text_column='评论内容',
+            sample_size=config.get('comparison_sample_size', 100),
+            random_state=config.get('comparison_random_state'),
+            output_file=config.get('comparison_output_file', '模型对比结果.xlsx'),
+            output_config=config.get('output', {})
+        )
+        return True
+    except Exception as e:
+        print(f"合并分片时出错: {str(e)}")
+        return False
+
+
+def run_cascade_evaluation(config):
+    """在模型对比的样本上评估级联打分"""
+    cascade_config = config.get('cascade', {})
+    evaluate_cascade(
+        output_paths(config)['processed_comments'],
+        text_column='评论内容',
+        sample_size=config.get('comparison_sample_size', 100),
+        low=cascade_config.get('low', 0.3),
+        high=cascade_config.get('high', 0.7),
+        model_key=cascade_config.get('model', 'bert_wwm'),
+        output_file=config.get('cascade_evaluation_file', '级联打分评估.xlsx'),
+        output_config=config.get('output', {}),
+        token_cache_dir=config.get('token_cache_dir'),
+        batch_size=config.get('transformer_batch_size', 32),
+        random_state=config.get('comparison_random_state')
+    )
+    return True
+
+
+def run_distillation(config):
+    """用模型对比结果中的Transformer打分训练蒸馏模型，并输出与BERT-WWM、SnowNLP的一致性和速度对比"""
+    distillation_config = config.get('distillation', {})
+    report = train_distilled_model(
+        output_paths(config)['model_comparison'],
+        distillation_config.get('model_file', './.cache/distilled_model.joblib'),
+        teacher_column=distillation_config.get('teacher', 'BERT-WWM'),
+        text_column='评论内容',
+        report_file=distillation_config.get('report_file', '蒸馏模型评估.xlsx'),
+        output_config=config.get('output', {}),
+        random_state=config.get('comparison_random_state'),
+        n_features=distillation_config.get('n_features', 2 ** 20),
+        ngram_max=distillation_config.get('ngram_max', 3),
+        benchmark_teacher=distillation_config.get('benchmark_teacher', False),
+        token_cache_dir=config.get('token_cache_dir'),
+        batch_size=config.get('transformer_batch_size', 32),
+        min_train_samples=distillation_config.get('min_train_samples', 1000)
+    )
+    return report is not None
+
+
+def run_embedding_extraction(config):
+    """把评论编码为向量并追加写入向量库，已入库的评论不再重复编码"""
+    embedding_config = config.get('embedding', {})
+    extract_embeddings(
+        output_paths(config)['processed_comments'],
+        embedding_config.get('store_dir', './.cache/embeddings'),
+        text_column='评论内容',
+        model_key=embedding_config.get('model', 'bert_wwm'),
+        batch_size=config.get('transformer_batch_size', 32),
+        dtype=embedding_config.get('dtype', 'float16'),
+        pooling=embedding_config.get('pooling', 'mean'),
+        token_cache_dir=config.get('token_cache_dir')
+    )
+    return True
+
+
+def build_pipeline(config, resume=False):
+    """声明流程中的各个步骤，步骤间的依赖由输入输出文件自动推断"""
+    paths = output_paths(config)
+    distilled_model_file = config.get('distillation', {}).get('model_file', './.cache/distilled_model.joblib')
+    sentiment_inputs = [paths['processed_comments']]
+    if config.get('scoring_mode') == 'distilled':
+        sentiment_inputs.append(distilled_model_file)
+    stages = [
+        Stage('extract', run_extract,
+              inputs=[config['input_folder']],
+              outputs=[paths['raw_comments']],
+              config_keys=['output', 'skip_failed_files'],
+              description="提取并汇总评论数据"),
+        Stage('process', run_process,
+              inputs=[paths['raw_comments'], config['ip_address_file']],
+              outputs=[paths['processed_comments']],
+              config_keys=['output', 'sticker_features'],
+              description="处理评论数据"),
+        Stage('sentiment', lambda cfg: run_sentiment(cfg, resume),
+              inputs=sentiment_inputs,
+              outputs=[paths['sentiment_output']],
+              config_keys=['output', 'snownlp_backend', 'scoring_mode', 'cascade'],
+              description="进行情感分析"),
+        Stage('estimate', run_estimate,
+              inputs=sentiment_inputs,
+              outputs=[paths['sentiment_estimate']],
+              config_keys=['output', 'approximate', 'scoring_mode'],
+              description="渐进式近似估计各视频平均情感得分"),
+        Stage('cube', run_sentiment_cube,
+              inputs=[paths['sentiment_output']],
+              outputs=[paths['sentiment_cube']],
+              config_keys=['output', 'sentiment_cube'],
+              description="更新情感立方体"),
+        Stage('timeseries', run_sentiment_timeseries,
+              inputs=[paths['sentiment_output']],
+              outputs=[paths['sentiment_timeseries']],
+              config_keys=['output', 'sentiment_timeseries'],
+              description="生成逐日情感时间序列"),
+        Stage('comparison', lambda cfg: run_comparison(cfg, resume),
+              inputs=[paths['processed_comments']],
+              outputs=[paths['model_comparison']],
+              config_keys=['output', 'comparison_sample_size', 'comparison_random_state', 'distillation'],
+              description="进行模型对比分析",
+              # 蒸馏模型由下游的distill步骤训练，只用于缓存判断：重新训练后模型对比随之重新运行
+              watch=[distilled_model_file]),
+        Stage('cascade', run_cascade_evaluation,
+              inputs=[paths['processed_comments']],
+              outputs=[paths['cascade_evaluation']],
+              config_keys=['output', 'cascade', 'comparison_sample_size', 'comparison_random_state'],
+              description="评估级联打分"),
+        Stage('distill', run_distillation,
+              inputs=[paths['model_comparison']],
+              outputs=[distilled_model_file, paths['distillation_report']],
+              config_keys=['output', 'distillation', 'comparison_random_state'],
+              description="训练蒸馏模型"),
+        Stage('embeddings', run_embedding_extraction,
+              inputs=[paths['processed_comments']],
+              outputs=[os.path.join(config.get('embedding', {}).get('store_dir', './.cache/embeddings'), 'keys.bin')],
+              config_keys=['embedding'],
+              description="编码评论向量"),
+    ]
+    return Pipeline(stages, config, state_file=config.get('pipeline_state_file', '.cache/pipeline_state.json'),
+                    max_workers=config.get('pipeline_workers', 2))
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(
+        description="评论数据分析流程",
+        epilog="示例：python main.py run sentiment  只运行情感分析（上游步骤输入未变化时自动跳过）"
+    )
+    parser.add_argument('command', nargs='?', default='run', choices=['run', 'list', 'merge'],
+                        help="run：运行步骤（默认）；list：列出所有步骤及缓存状态；merge：合并分片结果")
+    parser.add_argument('stages', nargs='*',
+                        help="要运行的步骤，默认运行全部步骤（comparison、cascade、distill、embeddings、estimate只在配置开启时默认运行）")
+    parser.add_argument('--force', action='store_true',
+                        help="忽略缓存，强制重新运行指定的步骤")
+    parser.add_argument('--resume', action='store_true',
+                        help="从检查点继续情感分析和模型对比，跳过已打分的行")
+    parser.add_argument('--shard', metavar='i/N',
+                        help="只运行第i个分片（共N个），用于在多台机器上分别运行sentiment或comparison")
+    parser.add_argument('--shards', type=int, metavar='N',
+                        help="merge时的分片总数")
+    return parser.parse_args()
+
+
 def main():
     """主程序入口"""
+    args = parse_args()
+    
     # 加载配置
     config = load_config()
+    pipeline = build_pipeline(config, resume=args.resume)
     
-    print("=== 开始评论数据分析流程 ===")
-    
-    # 步骤1: 提取评论
-    print("\n[步骤1] 提取并汇总评论数据...")
-    raw_comments = process_folder(config['input_folder'])
-    if raw_comments is not None:
-        raw_comments_file = config['raw_comments_file']
-        raw_comments.to_excel(raw_comments_file, index=False)
-        print(f"原始评论已保存至：{raw_comments_file}")
-    else:
-        print("评论提取失败，程序终止")
+    if args.command == 'merge' or args.shard:
+        stages = args.stages or ['sentiment']
+        unsupported = [name for name in stages if name not in ('sentiment', 'comparison')]
+        if unsupported:
+            print(f"只有sentiment和comparison支持分片：{', '.join(unsupported)}")
+            return
+        
+        if args.command == 'merge':
+            if not args.shards:
+                print("merge需要通过 --shards N 指定分片总数")
+                return
+            for name in stages:
+                print(f"\n[{name}] 合并 {args.shards} 个分片...")
+                if merge_stage_shards(config, name, args.shards):
+                    pipeline.mark_done(name)
+            return
+        
+        # 分片运行要求上游输出已存在（例如各机器共享同一份添加属性列.xlsx），不经过流程缓存
+        shard = parse_shard(args.shard)
+        runners = {'sentiment': run_sentiment, 'comparison': run_comparison}
+        for name in stages:
+            print(f"\n[{name}] 运行分片 {shard[0]}/{shard[1]}...")
+            runners[name](config, resume=args.resume, shard=shard)
         return
     
-    # 步骤2: 处理评论数据
-    print("\n[步骤2] 处理评论数据...")
-    processed_df = process_comments_data(
-        raw_comments_file,
-        config['processed_comments_file'],
-        config['ip_address_file']
-    )
-    if processed_df is None:
-        print("评论处理失败，程序终止")
+    if args.command == 'list':
+        for name, stage in pipeline.stages.items():
+            state = '已缓存' if pipeline.is_fresh(name) else '需要运行'
+            deps = ', '.join(pipeline.dependencies(name)) or '-'
+            print(f"{name:<12}{stage.description}（依赖：{deps}，{state}）")
         return
     
-    # 步骤3: 情感分析
-    print("\n[步骤3] 进行情感分析...")
-    sentiment_result = process_excel(
-        config['processed_comments_file'],
-        "评论内容",
-        config['sentiment_output_file']
-    )
+    targets = args.stages
+    if not targets:
+        # 可选步骤只有在配置中开启时才默认运行
+        optional = {'comparison': 'run_model_comparison', 'cascade': 'run_cascade_evaluation',
+                    'distill': 'run_distillation', 'embeddings': 'run_embedding_extraction',
+                    'estimate': 'run_approximate_estimate'}
+        targets = [name for name in pipeline.stages
+                   if name not in optional or config.get(optional[name], False)]
     
-    # 步骤4: 模型对比（可选）
-    if config.get('run_model_comparison', False):
-        print("\n[步骤4] 进行模型对比分析...")
-        results, stats = compare_models(
-            config['processed_comments_file'],
-            text_column='评论内容',
-            sample_size=config.get('comparison_sample_size', 100)
-        )
+    print("=== 开始评论数据分析流程 ===")
+    status = pipeline.run(targets, force=args.force)
     
+    if any(result in ('failed', 'skipped') for result in status.values()):
+        print("\n=== 部分步骤失败，程序终止 ===")
+        return
     print("\n=== 所有处理完成 ===")
 
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,185 @@
+"""
+文件功能：长时间打分任务的检查点与错误日志。打分结果每N行追加写入检查点文件，中断后可以跳过已打分的行继续运行；
+        逐行打分的异常写入结构化的错误日志（JSON Lines），不再只打印到屏幕
+"""
+
+import io
+import json
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from src.utils import comment_fingerprint
+
+ROW_COLUMN = '行号'
+FINGERPRINT_COLUMN = '评论指纹'
+
+
+class ResultCheckpoint:
+    """
+    追加写入的CSV检查点，每行记录输入文件中的行号、评论指纹和打分结果
+    每批结果一次性写入并刷盘，中断时最多只丢失写了一半的最后一行；打分设置记录在同名的.meta.json中
+    """
+
+    def __init__(self, path, resume=False, signature=None):
+        """
+        参数:
+        path: 检查点文件路径
+        resume: 为True时保留已有检查点继续追加；为False时清空旧检查点重新开始
+        signature: 打分设置（可JSON序列化的字典，如 {'scoring_mode': 'cascade'}），续跑时与检查点记录的设置
+                   不一致会抛出ValueError，避免把不同模型的得分混在一起
+        """
+        self.path = path
+        self.meta_file = path + '.meta.json'
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if not resume:
+            for file in (path, self.meta_file):
+                if os.path.exists(file):
+                    os.remove(file)
+        if signature is not None:
+            signature = json.loads(json.dumps(signature, ensure_ascii=False))
+            if resume and os.path.exists(path) and os.path.getsize(path) > 0:
+                stored = None
+                if os.path.exists(self.meta_file):
+                    with open(self.meta_file, encoding='utf-8') as f:
+                        stored = json.load(f)
+                if stored != signature:
+                    raise ValueError(f"检查点 {path} 的打分设置为 {stored}，与当前设置 {signature} 不一致，"
+                                     f"不能续跑，请去掉 --resume 重新运行")
+            with open(self.meta_file, 'w', encoding='utf-8') as f:
+                json.dump(signature, f, ensure_ascii=False)
+        self._drop_partial_line()
+
+    def _drop_partial_line(self):
+        """截掉中断时写了一半的最后一行"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def load(self):
+        """
+        读取检查点中的全部结果，同一行号重复出现时保留最后一次
+
+        返回:
+        DataFrame: 检查点内容，没有检查点时返回空DataFrame
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return pd.DataFrame(columns=[ROW_COLUMN, FINGERPRINT_COLUMN])
+        df = pd.read_csv(self.path, dtype={FINGERPRINT_COLUMN: str})
+        return df.drop_duplicates(subset=ROW_COLUMN, keep='last').reset_index(drop=True)
+
+    def completed_rows(self, fingerprints):
+        """
+        返回已完成打分的行号，评论指纹与当前输入不一致的行（输入文件已变化）视为未完成
+
+        参数:
+        fingerprints: 当前输入每行的评论指纹（Series，索引为行号）
+
+        返回:
+        set: 已完成的行号
+        """
+        done = self.load()
+        if done.empty:
+            return set()
+        rows = done[ROW_COLUMN].astype(int)
+        valid = rows.isin(fingerprints.index)
+        valid[valid] = fingerprints.reindex(rows[valid]).values == done.loc[valid, FINGERPRINT_COLUMN].values
+        if (~valid).any():
+            print(f"检查点中有 {(~valid).sum()} 行与当前输入不一致，将重新打分")
+        return set(rows[valid])
+
+    def append(self, df):
+        """追加一批结果，df必须包含行号和评论指纹列"""
+        write_header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=write_header)
+        with open(self.path, 'a', encoding='utf-8', newline='') as f:
+            f.write(buffer.getvalue())
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class ErrorLog:
+    """逐行打分错误的结构化日志，每条错误一行JSON"""
+
+    def __init__(self, path, resume=False):
+        """
+        参数:
+        path: 错误日志文件路径
+        resume: 为True时在已有日志后追加；为False时清空旧日志
+        """
+        self.path = path
+        self.count = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if not resume and os.path.exists(path):
+            os.remove(path)
+
+    def record(self, model, text, error, row=None):
+        """
+        记录一条错误
+
+        参数:
+        model: 出错的模型名称
+        text: 出错的文本
+        error: 异常对象或错误信息
+        row: 输入文件中的行号（可选），相同文本出现在多行时为行号列表
+        """
+        entry = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'model': model,
+            'row': row,
+            'text': None if pd.isna(text) else str(text),
+            'error_type': type(error).__name__ if isinstance(error, Exception) else None,
+            'error': str(error),
+        }
+        with open(self.path, 'a', encoding='utf-8') as f:
+            # 行号可能是NumPy整数
+            f.write(json.dumps(entry, ensure_ascii=False,
+                               default=lambda value: value.item() if hasattr(value, 'item') else str(value)) + '\n')
+        self.count += 1
+
+
+def report_error(error_log, model, text, error, row=None):
+    """有错误日志时写入日志，否则按原来的方式打印到屏幕"""
+    if error_log is not None:
+        error_log.record(model, text, error, row)
+    else:
+        print(f"{model}处理文本时出错: {text}")
+        print(f"错误信息: {str(error)}")
+
+
+def score_with_checkpoint(texts, score_func, checkpoint, every=1000):
+    """
+    分块打分并把每块结果追加写入检查点，已在检查点中的行直接跳过
+
+    参数:
+    texts: 待打分的文本（Series，索引为行号）
+    score_func: 打分函数，输入文本Series，返回DataFrame（每列一个得分）或与输入等长的得分序列
+    checkpoint: ResultCheckpoint对象
+    every: 每多少行写一次检查点
+
+    返回:
+    DataFrame: 全部行的打分结果（顺序与texts一致，索引为行号）
+    """
+    fingerprints = texts.map(comment_fingerprint)
+    done = checkpoint.completed_rows(fingerprints)
+    todo = [row for row in texts.index if row not in done]
+    if done:
+        print(f"从检查点恢复：已完成 {len(texts) - len(todo)} 行，剩余 {len(todo)} 行")
+
+    for start in range(0, len(todo), every):
+        rows = todo[start:start + every]
+        scores = score_func(texts.loc[rows])
+        chunk = scores.reset_index(drop=True) if isinstance(scores, pd.DataFrame) \
+            else pd.DataFrame({'得分': list(scores)})
+        chunk.insert(0, FINGERPRINT_COLUMN, fingerprints.loc[rows].values)
+        chunk.insert(0, ROW_COLUMN, rows)
+        checkpoint.append(chunk)
+        print(f"已打分 {len(texts) - len(todo) + start + len(rows)}/{len(texts)} 行")
+
+    results = checkpoint.load().set_index(ROW_COLUMN)
+    return results.reindex(texts.index).drop(columns=[FINGERPRINT_COLUMN])
@@ -0,0 +1,210 @@
+"""
+文件功能：把Transformer模型的打分蒸馏为字符n-gram TF-IDF + 逻辑回归的线性模型。以模型对比结果中BERT-WWM的
+        正面概率作为软标签训练，打分时只需哈希特征和一次稀疏矩阵乘法，速度接近SnowNLP、结果接近Transformer
+"""
+
+import os
+import time
+from functools import lru_cache
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import make_pipeline
+
+from src.output_writer import read_table, resolve_output_path, write_table
+from src.snownlp_batch import clear_segment_cache, get_batch_scorer
+from src.utils import comment_fingerprint
+
+DISTILLED_COLUMN = '蒸馏模型'
+
+
+def _clean(text):
+    """空值按空字符串处理"""
+    return '' if pd.isna(text) else str(text).strip()
+
+
+def build_distilled_pipeline(n_features=2 ** 20, ngram_max=3, C=4.0):
+    """
+    构建未训练的蒸馏模型
+
+    参数:
+    n_features: 哈希特征维度，特征不需要词表，新评论中的新字也能直接映射
+    ngram_max: 字符n-gram的最大长度（最小为1）
+    C: 逻辑回归的正则化强度倒数
+
+    返回:
+    sklearn.pipeline.Pipeline: HashingVectorizer -> TfidfTransformer -> LogisticRegression
+    """
+    return make_pipeline(
+        HashingVectorizer(analyzer='char', ngram_range=(1, ngram_max), n_features=n_features,
+                          alternate_sign=False, norm=None, preprocessor=_clean),
+        TfidfTransformer(sublinear_tf=True),
+        LogisticRegression(C=C, max_iter=1000),
+    )
+
+
+def fit_soft_labels(model, texts, soft_labels):
+    """
+    用软标签训练：每条评论拆成正、负两个样本，样本权重分别为教师模型给出的正面概率p和1-p，
+    等价于最小化与教师概率分布的交叉熵
+
+    参数:
+    model: build_distilled_pipeline返回的模型
+    texts: 评论文本序列
+    soft_labels: 教师模型的正面概率
+
+    返回:
+    训练好的模型
+    """
+    texts = list(texts)
+    soft_labels = np.asarray(soft_labels, dtype=float)
+    doubled = texts + texts
+    labels = np.r_[np.ones(len(texts), dtype=int), np.zeros(len(texts), dtype=int)]
+    weights = np.r_[soft_labels, 1 - soft_labels]
+    model.fit(doubled, labels, logisticregression__sample_weight=weights)
+    return model
+
+
+def _throughput(func, texts):
+    """返回(得分, 每秒处理条数)"""
+    start = time.perf_counter()
+    scores = np.asarray(func(texts), dtype=float)
+    elapsed = time.perf_counter() - start
+    return scores, (len(texts) / elapsed if elapsed > 0 else float('inf'))
+
+
+def _agreement(scores, teacher):
+    """与教师模型正负判断一致的比例和平均绝对误差"""
+    valid = ~np.isnan(scores)
+    return (
+        float(((scores[valid] >= 0.5) == (teacher[valid] >= 0.5)).mean()),
+        float(np.abs(scores[valid] - teacher[valid]).mean()),
+    )
+
+
+def train_distilled_model(comparison_file, model_file, teacher_column='BERT-WWM', text_column='评论内容',
+                          report_file=None, output_config=None, test_size=0.2, random_state=42,
+                          n_features=2 ** 20, ngram_max=3, benchmark_teacher=False,
+                          token_cache_dir=None, batch_size=32, min_train_samples=1000):
+    """
+    从模型对比结果训练蒸馏模型，并在留出集上对比蒸馏模型、BERT-WWM和SnowNLP的一致性与速度
+
+    参数:
+    comparison_file: compare_models输出的模型对比结果文件
+    model_file: 蒸馏模型保存路径（joblib格式）
+    teacher_column: 作为软标签的教师模型列
+    text_column: 评论内容列名
+    report_file: 评估报告输出路径（可选）
+    output_config: config.yaml中的output配置（可选）
+    test_size: 留出集比例
+    random_state: 划分留出集的随机种子
+    n_features, ngram_max: 见build_distilled_pipeline
+    benchmark_teacher: 为True时加载教师模型在留出集上重新打分以测量其速度（需要Transformer模型）
+    token_cache_dir, batch_size: 测量教师模型速度时的分词缓存目录和批次大小
+    min_train_samples: 训练样本少于该数量时给出警告（少于10条时不训练）
+
+    返回:
+    DataFrame: 评估报告，教师模型得分列不存在或样本不足时返回None
+    """
+    df = read_table(comparison_file)
+    if teacher_column not in df.columns:
+        print(f"模型对比结果中没有 '{teacher_column}' 列，无法蒸馏")
+        return None
+    df = df[[text_column, teacher_column] + [c for c in ['SnowNLP'] if c in df.columns]]
+    df = df.dropna(subset=[text_column, teacher_column])
+    if len(df) < 10:
+        print(f"可用于蒸馏的样本只有 {len(df)} 条，请增大comparison_sample_size后重新运行模型对比")
+        return None
+
+    train_df, test_df = train_test_split(df, test_size=test_size, random_state=random_state)
+    if len(train_df) < min_train_samples:
+        print(f"警告：训练样本只有 {len(train_df)} 条（建议至少 {min_train_samples} 条），蒸馏模型可能明显不如教师模型，"
+              f"请调大comparison_sample_size后重新运行模型对比")
+    model = fit_soft_labels(build_distilled_pipeline(n_features, ngram_max),
+                            train_df[text_column], train_df[teacher_column])
+    # 记录训练样本的评论指纹，模型对比中只对未参与训练的评论给出蒸馏模型得分
+    model.training_fingerprints_ = sorted(set(train_df[text_column].map(comment_fingerprint)))
+    os.makedirs(os.path.dirname(os.path.abspath(model_file)), exist_ok=True)
+    joblib.dump(model, model_file)
+    load_distilled_model.cache_clear()
+    print(f"蒸馏模型已保存至: {model_file}（训练样本 {len(train_df)} 条）")
+
+    texts = test_df[text_column].tolist()
+    teacher = test_df[teacher_column].to_numpy(dtype=float)
+    distilled_scores, distilled_speed = _throughput(lambda t: model.predict_proba(t)[:, 1], texts)
+    clear_segment_cache()  # 不使用之前打分留下的分词缓存，按冷启动计时
+    snownlp_timed, snownlp_speed = _throughput(get_batch_scorer().score, texts)
+    # 模型对比中的SnowNLP得分经过了与Transformer相同的预处理，一致性以它为准
+    snownlp_scores = test_df['SnowNLP'].to_numpy(dtype=float) if 'SnowNLP' in test_df else snownlp_timed
+
+    rows = []
+    for name, scores, speed in ((DISTILLED_COLUMN, distilled_scores, distilled_speed),
+                                ('SnowNLP', snownlp_scores, snownlp_speed)):
+        accuracy, mae = _agreement(scores, teacher)
+        rows.append({'模型': name, '与教师模型一致率': accuracy, '平均绝对误差': mae, '每秒处理条数': speed})
+
+    teacher_speed = np.nan
+    if benchmark_teacher:
+        from src.sentiment_analysis_compare import SentimentAnalyzer, TRANSFORMER_COLUMNS
+
+        model_key = {column: key for key, column in TRANSFORMER_COLUMNS.items()}.get(teacher_column, 'bert_wwm')
+        analyzer = SentimentAnalyzer(token_cache_dir=token_cache_dir)
+        if model_key == 'bert_wwm':
+            analyzer.init_bert_wwm_model()
+        else:
+            analyzer.init_weibo_model()
+        _, teacher_speed = _throughput(
+            lambda t: [np.nan if s is None else s
+                       for s in analyzer.batch_analyze_with_transformer(t, model_key, batch_size)],
+            texts
+        )
+    rows.append({'模型': teacher_column, '与教师模型一致率': 1.0, '平均绝对误差': 0.0, '每秒处理条数': teacher_speed})
+
+    report = pd.DataFrame(rows)
+    report.insert(1, '留出集样本数', len(test_df))
+    print("\n蒸馏模型评估（留出集）:")
+    print(report.to_string(index=False))
+    if report_file:
+        report_file = resolve_output_path(report_file, 'distillation_report', output_config)
+        write_table(report, report_file, 'distillation_report', output_config)
+        print(f"评估报告已保存至: {report_file}")
+    return report
+
+
+@lru_cache(maxsize=4)
+def load_distilled_model(model_file):
+    """加载蒸馏模型并在进程内复用"""
+    if not os.path.exists(model_file):
+        raise FileNotFoundError(f"未找到蒸馏模型 {model_file}，请先运行 python main.py run distill")
+    return joblib.load(model_file)
+
+
+def training_fingerprints(model_file):
+    """
+    蒸馏模型训练样本的评论指纹
+
+    返回:
+    set: 评论指纹集合，没有记录训练样本的旧模型返回空集合
+    """
+    return set(getattr(load_distilled_model(model_file), 'training_fingerprints_', ()))
+
+
+def score_distilled(texts, model_file):
+    """
+    使用蒸馏模型批量打分
+
+    参数:
+    texts: 文本序列
+    model_file: 蒸馏模型路径
+
+    返回:
+    np.ndarray: 每条文本的正面概率，空值为NaN
+    """
+    texts = list(texts)
+    scores = load_distilled_model(model_file).predict_proba(texts)[:, 1]
+    scores[[pd.isna(text) for text in texts]] = np.nan
+    return scores
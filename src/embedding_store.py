@@ -0,0 +1,243 @@
+"""
+文件功能：评论向量库。用BERT-WWM对评论批量编码一次，把池化后的向量按评论指纹写入追加式的内存映射数组，
+        之后聚类、相似评论检索和下游分类都直接读取向量，不必重新运行编码器
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.output_writer import read_table
+from src.utils import comment_fingerprint, file_lock
+
+FINGERPRINT_BYTES = 16  # comment_fingerprint为16位十六进制字符串
+
+
+class EmbeddingStore:
+    """
+    追加写入的向量库，目录下包含三个文件:
+        - meta.json: 向量维度、存储类型和编码模型
+        - vectors.bin: 按行追加的向量（L2归一化后存储，内积即余弦相似度）
+        - keys.bin: 每行向量对应的评论指纹，最后写入，作为一条记录写入完成的标志
+    追加写入和截断都在目录下.lock文件的排他锁内进行，多个进程可以同时向同一个向量库追加
+    """
+
+    def __init__(self, path, dim=None, dtype='float16', model_name=None):
+        """
+        参数:
+        path: 向量库目录
+        dim: 向量维度，新建向量库时必须指定；打开已有向量库时以meta.json为准
+        dtype: 存储类型，'float16' 或 'float32'
+        model_name: 编码模型名称，写入meta.json以免混用不同模型的向量
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta_file = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_file):
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+            if model_name and self.meta.get('model') and self.meta['model'] != model_name:
+                raise ValueError(f"向量库由 {self.meta['model']} 生成，不能追加 {model_name} 的向量")
+        else:
+            if dim is None:
+                raise ValueError("新建向量库时必须指定向量维度dim")
+            self.meta = {'dim': int(dim), 'dtype': np.dtype(dtype).name, 'model': model_name}
+            with open(meta_file, 'w', encoding='utf-8') as f:
+                json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        self.dim = self.meta['dim']
+        self.dtype = np.dtype(self.meta['dtype'])
+        self._ann_index = None
+        self.index = {}
+        with file_lock(self._file('.lock')):
+            self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        """映射向量和指纹文件，并截掉上次中断时写了一半的记录；必须在持有锁时调用"""
+        row_bytes = self.dim * self.dtype.itemsize
+        sizes = [os.path.getsize(self._file(name)) if os.path.exists(self._file(name)) else 0
+                 for name in ('keys.bin', 'vectors.bin')]
+        n = min(sizes[0] // FINGERPRINT_BYTES, sizes[1] // row_bytes)
+        for name, size in (('keys.bin', n * FINGERPRINT_BYTES), ('vectors.bin', n * row_bytes)):
+            if os.path.exists(self._file(name)) and os.path.getsize(self._file(name)) != size:
+                os.truncate(self._file(name), size)
+
+        if n == 0:
+            self.keys = np.empty(0, dtype=f'S{FINGERPRINT_BYTES}')
+            self.vectors = np.empty((0, self.dim), dtype=self.dtype)
+        else:
+            self.keys = np.memmap(self._file('keys.bin'), dtype=f'S{FINGERPRINT_BYTES}', mode='r', shape=(n,))
+            self.vectors = np.memmap(self._file('vectors.bin'), dtype=self.dtype, mode='r', shape=(n, self.dim))
+        # 只为新增的行建立索引，分块追加时不必每次重建整个字典
+        start = len(self.index) if len(self.index) <= n else 0
+        if start == 0:
+            self.index = {}
+        self.index.update((key.decode('ascii'), row) for row, key in enumerate(self.keys[start:].tolist(), start=start))
+        self._ann_index = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self.index
+
+    def missing(self, fingerprints):
+        """返回尚未入库的评论指纹（去重，保持首次出现的顺序）"""
+        return list(dict.fromkeys(fp for fp in fingerprints if fp not in self.index))
+
+    def append(self, fingerprints, vectors):
+        """
+        追加向量，已入库或同批重复的指纹会被跳过
+
+        参数:
+        fingerprints: 评论指纹列表
+        vectors: 与指纹一一对应的二维数组
+
+        返回:
+        int: 实际写入的条数
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[1:] != (self.dim,):
+            raise ValueError(f"向量维度应为 {self.dim}，当前为 {vectors.shape[1:]}")
+        with file_lock(self._file('.lock')):
+            self.keys = self.vectors = None  # 释放旧的映射后再写入
+            # 先读入其他进程在此期间追加的行，再跳过已入库和同批重复的指纹
+            self._load()
+            keep = []
+            seen = set()
+            for i, fp in enumerate(fingerprints):
+                if fp not in self.index and fp not in seen:
+                    seen.add(fp)
+                    keep.append(i)
+            if not keep:
+                return 0
+
+            norms = np.linalg.norm(vectors[keep], axis=1, keepdims=True)
+            normalized = (vectors[keep] / np.maximum(norms, 1e-12)).astype(self.dtype)
+            self.keys = self.vectors = None
+            with open(self._file('vectors.bin'), 'ab') as f:
+                normalized.tofile(f)
+            with open(self._file('keys.bin'), 'ab') as f:
+                np.array([fingerprints[i] for i in keep], dtype=f'S{FINGERPRINT_BYTES}').tofile(f)
+            self._load()
+        return len(keep)
+
+    def get(self, fingerprints):
+        """按评论指纹取出向量（float32），不存在的指纹返回NaN行"""
+        result = np.full((len(fingerprints), self.dim), np.nan, dtype=np.float32)
+        rows = [(i, self.index[fp]) for i, fp in enumerate(fingerprints) if fp in self.index]
+        if rows:
+            positions, store_rows = zip(*rows)
+            result[list(positions)] = self.vectors[list(store_rows)]
+        return result
+
+    def build_ann_index(self):
+        """
+        构建近似最近邻索引（需要安装faiss，可选）
+
+        返回:
+        bool: faiss可用并构建成功时返回True
+        """
+        try:
+            import faiss
+        except ImportError:
+            print("未安装faiss，相似检索使用NumPy暴力计算")
+            return False
+        index = faiss.IndexHNSWFlat(self.dim, 32, faiss.METRIC_INNER_PRODUCT)
+        for start in range(0, len(self), 65536):
+            index.add(np.ascontiguousarray(self.vectors[start:start + 65536], dtype=np.float32))
+        self._ann_index = index
+        return True
+
+    def search(self, query, k=10, chunk_size=65536):
+        """
+        检索与查询向量最相似的评论（余弦相似度）
+
+        参数:
+        query: 一维查询向量，或按行排列的多个查询向量
+        k: 每个查询返回的条数
+        chunk_size: 暴力计算时每次读入内存的向量行数
+
+        返回:
+        DataFrame: 查询序号、排名、评论指纹和相似度
+        """
+        query = np.atleast_2d(np.asarray(query, dtype=np.float32))
+        query = query / np.maximum(np.linalg.norm(query, axis=1, keepdims=True), 1e-12)
+        k = min(k, len(self))
+        if k == 0:
+            return pd.DataFrame(columns=['查询序号', '排名', '评论指纹', '相似度'])
+
+        if self._ann_index is not None:
+            scores, rows = self._ann_index.search(query, k)
+        else:
+            # 分块计算内积并只保留每块的前k名，内存占用与向量库大小无关
+            best_scores = np.full((len(query), 0), -np.inf, dtype=np.float32)
+            best_rows = np.empty((len(query), 0), dtype=np.int64)
+            for start in range(0, len(self), chunk_size):
+                block = np.asarray(self.vectors[start:start + chunk_size], dtype=np.float32)
+                block_scores = query @ block.T
+                top = np.argpartition(-block_scores, min(k, block.shape[0]) - 1, axis=1)[:, :k]
+                best_scores = np.hstack([best_scores, np.take_along_axis(block_scores, top, axis=1)])
+                best_rows = np.hstack([best_rows, top + start])
+                keep = np.argsort(-best_scores, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+            scores, rows = best_scores, best_rows
+
+        keys = self.keys
+        return pd.DataFrame([
+            {'查询序号': q, '排名': rank + 1, '评论指纹': keys[row].decode('ascii'), '相似度': float(score)}
+            for q in range(len(query))
+            for rank, (row, score) in enumerate(zip(rows[q], scores[q])) if row >= 0
+        ])
+
+
+def extract_embeddings(input_file, store_dir, text_column='评论内容', model_key='bert_wwm',
+                       batch_size=32, dtype='float16', pooling='mean', token_cache_dir=None):
+    """
+    对输入文件中尚未入库的评论批量编码，并追加写入向量库
+
+    参数:
+    input_file: 输入文件路径
+    store_dir: 向量库目录
+    text_column: 评论内容列名
+    model_key: 编码使用的Transformer模型键
+    batch_size: 批次大小
+    dtype: 向量存储类型，'float16' 或 'float32'
+    pooling: 池化方式，'mean'（按attention_mask平均）或 'cls'
+    token_cache_dir: 分词缓存目录（可选）
+
+    返回:
+    EmbeddingStore: 更新后的向量库
+    """
+    # 编码需要Transformer模型，按需导入
+    from src.sentiment_analysis_compare import SentimentAnalyzer
+
+    df = read_table(input_file)
+    texts = df[text_column].dropna().astype(str)
+    fingerprints = texts.map(comment_fingerprint)
+
+    analyzer = SentimentAnalyzer(token_cache_dir=token_cache_dir)
+    if model_key == 'bert_wwm':
+        analyzer.init_bert_wwm_model()
+    else:
+        analyzer.init_weibo_model()
+    model, tokenizer = analyzer.models[model_key]
+
+    store = EmbeddingStore(store_dir, dim=model.config.hidden_size, dtype=dtype,
+                           model_name=f"{tokenizer.name_or_path}:{pooling}")
+    missing = set(store.missing(fingerprints))
+    todo = texts[fingerprints.isin(missing) & ~fingerprints.duplicated()]
+    print(f"向量库已有 {len(store)} 条，本次需要编码 {len(todo)} 条")
+
+    # 分块编码并追加，中断后重新运行只会编码尚未入库的评论
+    for start in range(0, len(todo), batch_size * 32):
+        chunk = todo.iloc[start:start + batch_size * 32]
+        vectors = analyzer.encode_texts(chunk.tolist(), model_key, batch_size, pooling)
+        store.append(fingerprints.loc[chunk.index].tolist(), vectors)
+        print(f"已编码 {min(start + len(chunk), len(todo))}/{len(todo)} 条")
+    return store
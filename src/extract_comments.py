@@ -8,12 +8,104 @@ import pandas as pd
 import os
 import re
 
-def extract_comments(excel_path):
+from src.output_writer import write_table
+
+# 定义两种可能的列名组合
+COLUMN_SETS = [
+    ['评论内容', '一级评论ID', '评论时间', 'IP地址'],
+    ['评论内容', '评论类型', '评论时间', 'IP地址']
+]
+
+# 整表读取时各列的类型：ID/类型列保持原始对象，避免数字ID被转成字符串后误判为十六进制ID
+COLUMN_DTYPES = {
+    '评论内容': 'object',
+    '一级评论ID': 'object',
+    '评论类型': 'object',
+    '评论时间': 'object',  # 先将日期列读取为对象类型
+    'IP地址': 'object',
+}
+
+
+def probe_header(excel_path):
+    """
+    只读取Excel文件第一个工作表的表头行
+
+    参数:
+    excel_path: Excel文件路径
+
+    返回:
+    list: 表头列名列表（保留原始写法，包括首尾空格，以便直接作为usecols传给pandas）
+    """
+    if excel_path.lower().endswith('.xlsx'):
+        from openpyxl import load_workbook
+
+        # 只读模式按需解析，读取第一行后立即关闭，不加载整个工作簿
+        workbook = load_workbook(excel_path, read_only=True)
+        try:
+            worksheet = workbook.worksheets[0]
+            header = next(worksheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+        finally:
+            workbook.close()
+        return [str(col) for col in header if col is not None]
+
+    # .xls文件openpyxl无法读取，退回到pandas只读表头
+    return [str(col) for col in pd.read_excel(excel_path, nrows=0).columns]
+
+
+def build_ingestion_plan(folder_path):
+    """
+    探测文件夹中每个Excel文件的表头，与COLUMN_SETS比对后生成读取计划
+
+    参数:
+    folder_path: 包含Excel文件的文件夹路径
+
+    返回:
+    list: 每个文件一个字典，包含以下键:
+        - file: 文件名
+        - path: 文件路径
+        - columns: 需要读取的列，为表头中的原始列名（校验失败时为None）
+        - error: 校验失败原因（校验通过时为None）
+    """
+    plan = []
+    excel_files = [f for f in os.listdir(folder_path) if f.endswith(('.xlsx', '.xls'))]
+    for file in excel_files:
+        file_path = os.path.join(folder_path, file)
+        entry = {'file': file, 'path': file_path, 'columns': None, 'error': None}
+        try:
+            # 比对时忽略列名首尾的空格，读取时仍使用原始列名
+            raw_names = {}
+            for col in probe_header(file_path):
+                raw_names.setdefault(col.strip(), col)
+            header = list(raw_names)
+            found = next((cols for cols in COLUMN_SETS if all(col in header for col in cols)), None)
+            if found is not None:
+                entry['columns'] = [raw_names[col] for col in found]
+            else:
+                missing = min(([col for col in cols if col not in header] for cols in COLUMN_SETS), key=len)
+                entry['error'] = f"缺少必要的列：{'、'.join(missing)}"
+        except Exception as e:
+            entry['error'] = f"无法读取表头：{str(e)}"
+        plan.append(entry)
+    return plan
+
+
+def print_ingestion_plan(plan):
+    """打印读取计划中每个文件的校验结果"""
+    print("表头校验结果：")
+    for entry in plan:
+        if entry['error'] is None:
+            print(f"  [通过] {entry['file']}：{'、'.join(entry['columns'])}")
+        else:
+            print(f"  [失败] {entry['file']}：{entry['error']}")
+
+
+def extract_comments(excel_path, columns=None):
     """
     从Excel文件中提取评论内容、一级评论ID/评论类型和宣传片内容
     
     参数:
     excel_path: Excel文件的路径，文件名将被用作宣传片内容
+    columns: 由build_ingestion_plan确定的列组合（可选），指定后只读取这些列，不再整表读取后检查
     
     返回：
     DataFrame: 包含以下列的数据框:
@@ -25,23 +117,19 @@ def extract_comments(excel_path):
     ValueError: 当Excel文件缺少必要的列组合时抛出
     """
     try:
-        # 读取Excel文件
+        # 读取Excel文件，已知列组合时只读取需要的列
         df = pd.read_excel(
             excel_path,
-            dtype={'评论时间': 'object'}  # 先将日期列读取为对象类型
+            usecols=columns,
+            dtype={col: COLUMN_DTYPES[col.strip()] for col in (columns or ['评论时间'])}
         )
+        df = df.rename(columns=lambda col: str(col).strip())  # 去掉列名首尾的空格
         df['评论时间'] = pd.to_datetime(df['评论时间'], errors='coerce')
         df['评论时间'] = df['评论时间'].dt.strftime('%Y-%m-%d')  # 格式化为年-月-日
-
-        # 定义两种可能的列名组合
-        column_sets = [
-            ['评论内容', '一级评论ID', '评论时间', 'IP地址'],
-            ['评论内容', '评论类型', '评论时间', 'IP地址']
-        ]
         
         # 检查是否存在任一组列名
         found_columns = None
-        for cols in column_sets:
+        for cols in COLUMN_SETS:
             if all(col in df.columns for col in cols):
                 found_columns = cols
                 break
@@ -129,35 +217,53 @@ def add_main_comment_flag(df):
     return df
 
 
-def process_folder(folder_path):
+def process_folder(folder_path, skip_failed=False):
     """
     处理文件夹中的所有Excel文件并合并结果
     
     参数:
     folder_path: 包含Excel文件的文件夹路径
+    skip_failed: 为False时只要有文件表头校验失败或读取失败就返回None（在整表读取之前即可发现）；
+                 为True时跳过这些文件，并在最后列出
     
     返回:
     DataFrame: 合并后的数据框，包含所有文件的评论数据
-        - 如果成功处理至少一个文件，返回合并后的DataFrame
-        - 如果没有成功处理任何文件，返回None
+        - 如果成功处理至少一个文件（且没有失败的文件，或skip_failed为True），返回合并后的DataFrame
+        - 否则返回None
     """
     # 存储所有数据框的列表
     all_dataframes = []
     
-    # 获取文件夹中所有Excel文件
-    excel_files = [f for f in os.listdir(folder_path) if f.endswith(('.xlsx', '.xls'))]
-    print(f"找到 {len(excel_files)} 个Excel文件")
+    # 先只读取表头，校验所有Excel文件的列组合，不合格的文件不再整表读取
+    plan = build_ingestion_plan(folder_path)
+    print(f"找到 {len(plan)} 个Excel文件")
+    print_ingestion_plan(plan)
+    failed = [entry['file'] for entry in plan if entry['error'] is not None]
+    if failed and not skip_failed:
+        print(f"\n{len(failed)} 个文件表头校验失败：{'、'.join(failed)}，请修正后重新运行"
+              f"（或在config.yaml中设置 skip_failed_files: true 跳过这些文件）")
+        return None
     
-    # 处理每个Excel文件
-    for file in excel_files:
-        file_path = os.path.join(folder_path, file)
+    # 处理每个通过校验的Excel文件
+    for entry in plan:
+        if entry['error'] is not None:
+            continue
+        file = entry['file']
         print(f"\n处理文件: {file}")
-        df = extract_comments(file_path)
+        df = extract_comments(entry['path'], columns=entry['columns'])
         # df = convert_excel_date(df, date_column='评论时间')
         if df is not None:
             df = add_main_comment_flag(df) # 添加是否主评论列
             all_dataframes.append(df)
             print(f"成功提取评论数：{len(df)}")
+        elif not skip_failed:
+            print(f"\n文件处理失败：{file}，请修正后重新运行（或在config.yaml中设置 skip_failed_files: true 跳过失败的文件）")
+            return None
+        else:
+            failed.append(file)
+
+    if failed:
+        print(f"\n已跳过 {len(failed)} 个处理失败的文件：{'、'.join(failed)}")
     
     # 合并所有数据框
     if all_dataframes:
@@ -181,5 +287,5 @@ if __name__ == "__main__":
     if combined_comments is not None:
         # 保存合并后的结果
         comments_file = "所有评论汇总.xlsx"
-        combined_comments.to_excel(comments_file, index=False)
+        write_table(combined_comments, comments_file)
         print(f"\n汇总结果已保存至：{comments_file}")
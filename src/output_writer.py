@@ -0,0 +1,236 @@
+"""
+文件功能：统一的结果输出模块。xlsx使用xlsxwriter常量内存模式逐行流式写出，超过Excel行数上限时自动拆分到
+        多个工作表或多个文件；也可以在config.yaml中为每个输出文件单独指定parquet/csv格式
+"""
+
+import glob
+import os
+import re
+from datetime import datetime
+
+import pandas as pd
+
+# Excel单个工作表的最大行数（含表头）
+EXCEL_MAX_ROWS = 1048576
+SUPPORTED_FORMATS = ('xlsx', 'csv', 'parquet')
+
+# xlsxwriter会把文本中形如 _x000D_ 的字面量转义为 _x005F_x000D_，openpyxl读取时不会还原
+ESCAPED_LITERAL = re.compile(r'_x005F(_x[0-9A-Fa-f]{4}_)')
+
+
+def get_output_format(artifact=None, output_config=None, path=None):
+    """
+    确定某个输出文件应使用的格式
+
+    参数:
+    artifact: 输出文件的标识，对应config.yaml中output.formats下的键，例如 'sentiment_output'
+    output_config: config.yaml中的output配置（字典），可以为None
+    path: 原始输出路径，未配置格式时根据扩展名推断
+
+    返回:
+    str: 'xlsx'、'csv' 或 'parquet'
+    """
+    output_config = output_config or {}
+    fmt = (output_config.get('formats') or {}).get(artifact) if artifact else None
+    if fmt is None and path:
+        fmt = os.path.splitext(path)[1].lstrip('.').lower() or None
+    fmt = (fmt or output_config.get('default_format') or 'xlsx').lower()
+    if fmt == 'xls':
+        fmt = 'xlsx'
+    if fmt not in SUPPORTED_FORMATS:
+        raise ValueError(f"不支持的输出格式 '{fmt}'，可选：{', '.join(SUPPORTED_FORMATS)}")
+    return fmt
+
+
+def resolve_output_path(path, artifact=None, output_config=None):
+    """
+    根据配置的输出格式替换文件扩展名，例如 情感分析结果.xlsx -> 情感分析结果.parquet
+
+    返回:
+    str: 实际写出的文件路径（后续步骤应从这个路径读取）
+    """
+    fmt = get_output_format(artifact, output_config, path)
+    stem, ext = os.path.splitext(path)
+    if ext.lstrip('.').lower() == fmt:
+        return path
+    return f"{stem}.{fmt}"
+
+
+def _excel_rows(df, chunk_size=10000):
+    """
+    把DataFrame转换成可直接交给xlsxwriter的行迭代器（空值转为None，日期转为字符串）
+
+    按chunk_size行分块转换为object类型，同一时刻只多占用一个块的内存，不复制整个工作表的数据
+    """
+    datetime_columns = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])]
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        if datetime_columns:
+            chunk = chunk.copy()
+            for col in datetime_columns:
+                chunk[col] = chunk[col].dt.strftime('%Y-%m-%d %H:%M:%S')
+        chunk = chunk.astype(object).where(pd.notna(chunk), None)
+        yield from chunk.itertuples(index=False, name=None)
+
+
+def _write_excel_sheet(workbook, sheet_name, df, start, stop):
+    """把df的[start, stop)行写入一个新工作表，常量内存模式下必须按行顺序写入"""
+    worksheet = workbook.add_worksheet(sheet_name[:31])
+    worksheet.write_row(0, 0, [str(col) for col in df.columns])
+    for row_idx, row in enumerate(_excel_rows(df.iloc[start:stop]), start=1):
+        worksheet.write_row(row_idx, 0, row)
+
+
+def _split_bounds(n_rows, max_rows):
+    """按每个工作表可容纳的数据行数切分区间，空表也保留一个只有表头的工作表"""
+    per_sheet = max_rows - 1
+    bounds = [(start, min(start + per_sheet, n_rows)) for start in range(0, n_rows, per_sheet)]
+    return bounds or [(0, 0)]
+
+
+def _new_workbook(path):
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path, {
+        'constant_memory': True,
+        'strings_to_urls': False,       # 视频链接等不转换为超链接（单表超链接数量有上限）
+        'strings_to_formulas': False,   # 以'='开头的评论内容按普通文本写出
+        'nan_inf_to_errors': True,
+    })
+    # 固定创建时间，内容相同的数据写出的文件逐字节相同，流程执行器才能按内容哈希跳过下游步骤
+    workbook.set_properties({'created': datetime(2000, 1, 1)})
+    return workbook
+
+
+def _part_files(path):
+    """已存在的分文件 文件名_part2.xlsx、文件名_part3.xlsx ...，按序号排列"""
+    stem, ext = os.path.splitext(path)
+    part_pattern = re.compile(re.escape(stem) + r'_part(\d+)' + re.escape(ext) + '$')
+    part_files = [p for p in glob.glob(glob.escape(stem) + '_part*' + ext) if part_pattern.match(p)]
+    return sorted(part_files, key=lambda p: int(part_pattern.match(p).group(1)))
+
+
+def _write_excel(sheets, path, split_mode='sheet', max_rows=EXCEL_MAX_ROWS):
+    """
+    流式写出一个或多个工作表，超过行数上限的部分按split_mode拆分
+
+    返回:
+    list: 实际写出的文件路径列表
+    """
+    if split_mode not in ('sheet', 'file'):
+        raise ValueError(f"split_mode只能为 'sheet' 或 'file'，当前为 '{split_mode}'")
+
+    written = [path]
+    workbook = _new_workbook(path)
+    extra_parts = []
+    for sheet_name, df in sheets.items():
+        bounds = _split_bounds(len(df), max_rows)
+        for part, (start, stop) in enumerate(bounds, start=1):
+            if part == 1:
+                _write_excel_sheet(workbook, sheet_name, df, start, stop)
+            elif split_mode == 'sheet':
+                _write_excel_sheet(workbook, f"{sheet_name}_{part}", df, start, stop)
+            else:
+                extra_parts.append((part, sheet_name, start, stop, df))
+    workbook.close()
+
+    # 按文件拆分时，第2部分起写入 文件名_part2.xlsx、文件名_part3.xlsx ...
+    stem, ext = os.path.splitext(path)
+    part_books = {}
+    for part, sheet_name, start, stop, df in extra_parts:
+        if part not in part_books:
+            part_path = f"{stem}_part{part}{ext}"
+            part_books[part] = _new_workbook(part_path)
+            written.append(part_path)
+        _write_excel_sheet(part_books[part], sheet_name, df, start, stop)
+    for workbook in part_books.values():
+        workbook.close()
+    # 删除之前更大的结果留下、本次没有覆盖的分文件，否则read_table会把旧数据一起读回
+    for stale in set(_part_files(path)) - set(written):
+        os.remove(stale)
+
+    if len(written) > 1 or any(len(df) >= max_rows for df in sheets.values()):
+        print(f"数据超过Excel行数上限，已按{'工作表' if split_mode == 'sheet' else '文件'}拆分写出")
+    return written
+
+
+def write_tables(sheets, path, artifact=None, output_config=None):
+    """
+    写出包含一个或多个表的结果文件
+
+    参数:
+    sheets: 字典，key为工作表名，value为DataFrame（按插入顺序写出）
+    path: 输出文件路径，扩展名会根据配置的格式替换
+    artifact: 输出文件标识，对应config.yaml中output.formats下的键
+    output_config: config.yaml中的output配置
+
+    返回:
+    list: 实际写出的文件路径列表
+    """
+    output_config = output_config or {}
+    fmt = get_output_format(artifact, output_config, path)
+    path = resolve_output_path(path, artifact, output_config)
+
+    if fmt == 'xlsx':
+        return _write_excel(sheets, path, output_config.get('split_mode', 'sheet'),
+                            output_config.get('max_rows_per_sheet', EXCEL_MAX_ROWS))
+
+    # csv/parquet每个文件只能存一个表：第一个表写入path，其余表写入 文件名_表名.扩展名
+    written = []
+    stem, ext = os.path.splitext(path)
+    for i, (sheet_name, df) in enumerate(sheets.items()):
+        table_path = path if i == 0 else f"{stem}_{sheet_name}{ext}"
+        if fmt == 'csv':
+            df.to_csv(table_path, index=False, encoding='utf-8-sig')
+        else:
+            df.to_parquet(table_path, index=False)
+        written.append(table_path)
+    return written
+
+
+def write_table(df, path, artifact=None, output_config=None, sheet_name='Sheet1'):
+    """
+    写出单个DataFrame，用于替代 df.to_excel(path, index=False)
+
+    返回:
+    list: 实际写出的文件路径列表
+    """
+    return write_tables({sheet_name: df}, path, artifact, output_config)
+
+
+def read_table(path, **kwargs):
+    """
+    读取write_table写出的文件（xlsx/csv/parquet），自动合并拆分出的续表和分文件
+
+    参数:
+    path: 文件路径
+    kwargs: 透传给pandas读取函数的参数（如usecols、dtype）
+
+    返回:
+    DataFrame: 读取结果
+    """
+    ext = os.path.splitext(path)[1]
+    if ext.lower() == '.csv':
+        return pd.read_csv(path, **kwargs)
+    if ext.lower() == '.parquet':
+        if 'usecols' in kwargs:
+            kwargs['columns'] = kwargs.pop('usecols')
+        kwargs.pop('dtype', None)  # parquet自带列类型
+        return pd.read_parquet(path, **kwargs)
+    if kwargs.get('sheet_name') is not None:
+        return pd.read_excel(path, **kwargs)
+
+    frames = []
+    for file in [path] + _part_files(path):
+        with pd.ExcelFile(file) as xls:
+            first = xls.sheet_names[0]
+            continuation = re.compile(re.escape(first) + r'_\d+$')
+            for sheet in xls.sheet_names:
+                if sheet == first or continuation.match(sheet):
+                    frames.append(pd.read_excel(xls, sheet_name=sheet, **kwargs))
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    for col in df.columns[df.dtypes == object]:
+        escaped = df[col].str.contains('_x005F_x', regex=False, na=False)
+        if escaped.any():
+            df.loc[escaped, col] = df.loc[escaped, col].str.replace(ESCAPED_LITERAL, r'\1', regex=True)
+    return df
@@ -0,0 +1,187 @@
+"""
+文件功能：声明式的流程执行器。每个步骤声明输入文件、输出文件和依赖的配置项，步骤之间的依赖关系由输入输出自动推断；
+        输入文件内容和配置都未变化且输出仍存在的步骤直接跳过，互不依赖的步骤并行执行
+"""
+
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Stage:
+    """流程中的一个步骤"""
+
+    def __init__(self, name, func, inputs=(), outputs=(), config_keys=(), description='', watch=()):
+        """
+        参数:
+        name: 步骤名称，命令行中用它指定要运行的步骤
+        func: 执行函数，接收config参数，失败时返回False或抛出异常
+        inputs: 输入文件或文件夹路径列表
+        outputs: 输出文件路径列表
+        config_keys: 影响该步骤结果的配置项，配置变化时重新执行
+        description: 步骤说明
+        watch: 只参与缓存判断、不用于推断依赖的文件（可以不存在），例如由下游步骤生成、存在时才使用的模型文件
+        """
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.config_keys = list(config_keys)
+        self.description = description
+        self.watch = list(watch)
+
+
+def _hash_path(hasher, path):
+    """把文件（含拆分出的 _partN 分文件）或文件夹下所有文件的内容写入哈希"""
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, f) for root, _, names in os.walk(path) for f in names)
+    else:
+        stem, ext = os.path.splitext(path)
+        files = [path] + sorted(glob.glob(glob.escape(stem) + '_part*' + ext))
+    for file in files:
+        if not os.path.exists(file):
+            hasher.update(f"{file}:missing".encode('utf-8'))
+            continue
+        hasher.update(os.path.relpath(file, os.path.dirname(path) or '.').encode('utf-8'))
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                hasher.update(block)
+
+
+class Pipeline:
+    """按依赖关系执行多个Stage，并用输入内容哈希缓存结果"""
+
+    def __init__(self, stages, config, state_file='.cache/pipeline_state.json', max_workers=2):
+        """
+        参数:
+        stages: Stage列表
+        config: 配置字典，传给每个步骤
+        state_file: 记录每个步骤上次成功执行时输入哈希的文件
+        max_workers: 并行执行的最大步骤数
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.config = config
+        self.state_file = state_file
+        self.max_workers = max_workers
+        self.state = {}
+        if os.path.exists(state_file):
+            with open(state_file, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def dependencies(self, name):
+        """返回某个步骤直接依赖的步骤（其输出是该步骤的输入）"""
+        inputs = set(self.stages[name].inputs)
+        return [other.name for other in self.stages.values()
+                if other.name != name and inputs & set(other.outputs)]
+
+    def with_upstream(self, names):
+        """返回指定步骤及其全部上游步骤，按声明顺序排列；步骤之间存在循环依赖时抛出ValueError"""
+        selected, pending = set(), list(names)
+        while pending:
+            name = pending.pop()
+            if name not in self.stages:
+                raise ValueError(f"未知的步骤 '{name}'，可选：{', '.join(self.stages)}")
+            if name not in selected:
+                selected.add(name)
+                pending.extend(self.dependencies(name))
+        order = [name for name in self.stages if name in selected]
+        self._check_cycles(order)
+        return order
+
+    def _check_cycles(self, names):
+        """按拓扑排序逐层去掉没有未完成依赖的步骤，剩下的步骤构成循环依赖"""
+        remaining = {name: set(self.dependencies(name)) & set(names) for name in names}
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps & set(remaining)]
+            if not ready:
+                raise ValueError(f"步骤之间存在循环依赖：{', '.join(remaining)}")
+            for name in ready:
+                del remaining[name]
+
+    def fingerprint(self, name):
+        """计算步骤的缓存键：步骤名、相关配置和全部输入文件（含watch文件）的内容"""
+        stage = self.stages[name]
+        hasher = hashlib.sha256(name.encode('utf-8'))
+        config = {key: self.config.get(key) for key in stage.config_keys}
+        hasher.update(json.dumps(config, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+        for path in stage.inputs + stage.watch:
+            _hash_path(hasher, path)
+        return hasher.hexdigest()
+
+    def is_fresh(self, name):
+        """输出都存在且输入、配置与上次成功执行时一致"""
+        stage = self.stages[name]
+        return (all(os.path.exists(path) for path in stage.outputs)
+                and self.state.get(name) == self.fingerprint(name))
+
+    def mark_done(self, name):
+        """在流程之外生成了某个步骤的输出（如合并分片结果）后，记录为已按当前输入完成"""
+        self.state[name] = self.fingerprint(name)
+        self._save_state()
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+        with open(self.state_file, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+
+    def _run_stage(self, name, force):
+        """执行单个步骤，返回 'done'、'cached' 或 'failed'"""
+        stage = self.stages[name]
+        if not force and self.is_fresh(name):
+            print(f"\n[{name}] 输入和配置未变化，跳过")
+            return 'cached'
+        print(f"\n[{name}] {stage.description}...")
+        fingerprint = self.fingerprint(name)
+        try:
+            ok = stage.func(self.config)
+        except Exception as e:
+            print(f"[{name}] 执行出错: {str(e)}")
+            ok = False
+        if ok is False:
+            print(f"[{name}] 执行失败")
+            return 'failed'
+        self.state[name] = fingerprint
+        return 'done'
+
+    def run(self, targets=None, force=False):
+        """
+        执行指定步骤及其上游步骤，互不依赖的步骤并行执行
+
+        参数:
+        targets: 要执行的步骤名称列表，默认执行全部步骤
+        force: 为True时忽略缓存，强制重新执行targets中的步骤（上游步骤仍按缓存判断）
+
+        返回:
+        dict: 每个步骤的执行结果（'done'、'cached'、'failed' 或 'skipped'）
+        """
+        targets = list(targets or self.stages)
+        order = self.with_upstream(targets)
+        deps = {name: [d for d in self.dependencies(name) if d in order] for name in order}
+        status = {}
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while len(status) < len(order):
+                settled = len(status)
+                for name in order:
+                    if name in status or name in running.values():
+                        continue
+                    if any(status.get(d) in ('failed', 'skipped') for d in deps[name]):
+                        print(f"\n[{name}] 上游步骤失败，跳过")
+                        status[name] = 'skipped'
+                    elif all(status.get(d) in ('done', 'cached') for d in deps[name]):
+                        future = executor.submit(self._run_stage, name, force and name in targets)
+                        running[future] = name
+                if not running:
+                    if len(status) == settled:
+                        # 没有可执行的步骤也没有正在执行的步骤，继续循环只会空转
+                        pending = [name for name in order if name not in status]
+                        raise RuntimeError(f"以下步骤的依赖无法满足：{', '.join(pending)}")
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    status[running.pop(future)] = future.result()
+                self._save_state()
+        return status
@@ -4,9 +4,11 @@
 输出：处理后的评论汇总文件，文件格式为xlsx。输出位置为代码所在目录下
 """
 
-import re
 import pandas as pd
 
+from src.output_writer import read_table, resolve_output_path, write_table
+from src.sticker_index import StickerIndex
+
 
 def add_video_id(df):
     """
@@ -198,32 +200,44 @@ def add_time_diff(df):
         return df
 
 
-def add_comment_length(df):
+def add_comment_length(df, sticker_index=None):
     """
     计算去除表情后的评论字数、表情认为是1个字符的评论字数
     
     参数:
     df: 包含评论内容列的DataFrame
+    sticker_index: 评论内容列的StickerIndex（可选），已构建时直接复用，不再重新解析表情
     
     返回:
     DataFrame: 添加评论字数列后的数据框
     """
-    def count_text_length(text):
-        # 使用正则表达式去除表情符号（格式为[xxx]或[xxxR]）
-        clean_text = re.sub(r'\[[^\]]+\]', '', str(text))
-        # 去除其他特殊字符，只保留文字和空格
-        clean_text = re.sub(r'[^\w\s]', '', clean_text)
-        return len(clean_text.strip())
-    
-    def count_text_length_with_emojis(text):
-        # 使用正则表达式匹配表情符号（格式为[xxx]或[xxxR]）
-        clean_text = re.sub(r'\[[^\]]+\]', 'a', str(text))  # 将表情符号替换为'a'，占1个字符
-        # 去除其他特殊字符，只保留文字和空格
-        clean_text = re.sub(r'[^\w\s]', '', clean_text)
-        return len(clean_text.strip())
-    
-    df['评论字数'] = df['评论内容'].apply(count_text_length)
-    df['评论字数(加表情)'] = df['评论内容'].apply(count_text_length_with_emojis)
+    if sticker_index is None:
+        sticker_index = StickerIndex(df['评论内容'])
+    df['评论字数'] = sticker_index.lengths
+    df['评论字数(加表情)'] = sticker_index.lengths_with_stickers
+    return df
+
+
+def add_sticker_features(df, sticker_index=None):
+    """
+    添加表情数和表情情感得分列（每个表情名称用SnowNLP打分一次，评论得分为其中各表情得分的平均）
+    
+    参数:
+    df: 包含评论内容列的DataFrame
+    sticker_index: 评论内容列的StickerIndex（可选）
+    
+    返回:
+    DataFrame: 添加表情数、表情情感得分列后的数据框
+    """
+    if sticker_index is None:
+        sticker_index = StickerIndex(df['评论内容'])
+    df['表情数'] = sticker_index.sticker_counts
+    df['表情情感得分'] = sticker_index.polarity()
+    
+    print("\n表情统计:")
+    print(f"  表情种类数: {len(sticker_index.vocab)}")
+    print(f"  含表情的评论数: {(df['表情数'] > 0).sum()}")
+    print(f"  最常用的表情: {', '.join(sticker_index.vocab_frequency().head(5).index)}")
     return df
 
 
@@ -239,7 +253,7 @@ def add_ip_address(df, ip_address_file):
     """
     try:
         # 读取IP地址文件
-        ip_df = pd.read_excel(ip_address_file)
+        ip_df = read_table(ip_address_file)
         
         # 确保两个数据框有相同的长度用于合并
         if len(df) != len(ip_df):
@@ -292,20 +306,22 @@ def add_local_comment_flag(df):
     return df
 
 
-def process_comments_data(input_file, output_file, ip_address_file):
+def process_comments_data(input_file, output_file, ip_address_file, output_config=None, sticker_features=False):
     """
     处理评论汇总文件，添加新的属性列
     
     参数:
     input_file: 输入的Excel文件路径
     output_file: 输出的Excel文件路径
+    output_config: config.yaml中的output配置，用于选择输出格式（可选）
+    sticker_features: 为True时增加表情数和表情情感得分列
     
     返回:
     DataFrame: 处理后的数据框，包含新增的属性列
     """
     try:
         # 读取Excel文件
-        df = pd.read_excel(input_file)
+        df = read_table(input_file)
         
         # 1. 添加视频元数据信息
         metadata_dict = get_video_metadata()
@@ -322,11 +338,15 @@ def process_comments_data(input_file, output_file, ip_address_file):
         # 4. 处理其他属性列
         df = add_ai_generated_flag(df)  # 是否AI生成标记
         df = add_time_diff(df)  # 计算评论时间差
-        df = add_comment_length(df)  # 计算去除表情后的评论字数
+        sticker_index = StickerIndex(df['评论内容'])  # 表情只解析一次，评论字数和表情特征共用
+        df = add_comment_length(df, sticker_index)  # 计算去除表情后的评论字数
         df = add_local_comment_flag(df)  # 是否是本地人评论
+        if sticker_features:
+            df = add_sticker_features(df, sticker_index)  # 表情数和表情情感得分
 
         # 保存处理后的结果
-        df.to_excel(output_file, index=False)
+        output_file = resolve_output_path(output_file, 'processed_comments', output_config)
+        write_table(df, output_file, 'processed_comments', output_config)
         
         print(f"数据处理完成！")
         print(f"总评论数：{len(df)}")
@@ -0,0 +1,213 @@
+"""
+文件功能：渐进式近似情感估计。按宣传片ID分层，每轮从每个尚未达到精度的视频中随机抽取一批评论打分，
+        用Welford/Chan合并公式维护各组的运行均值和方差，按有限总体校正计算置信区间；某组的置信区间
+        半宽达到设定精度后即停止该组，只需对部分评论打分就能得到各视频的平均情感得分
+"""
+
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from src.output_writer import read_table, resolve_output_path, write_table
+
+
+class RunningStats:
+    """按组维护的运行计数、均值和离差平方和（M2），支持整批合并"""
+
+    def __init__(self, groups):
+        """
+        参数:
+        groups: 组标签列表
+        """
+        self.groups = pd.Index(groups)
+        self.count = np.zeros(len(groups))
+        self.mean = np.zeros(len(groups))
+        self.m2 = np.zeros(len(groups))
+
+    def update(self, group_codes, values):
+        """
+        合并一批新观测（Chan等人的并行合并公式，等价于逐个执行Welford更新）
+
+        参数:
+        group_codes: 每个观测所属组在groups中的位置
+        values: 观测值，NaN会被忽略
+        """
+        values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(values)
+        codes, values = np.asarray(group_codes)[valid], values[valid]
+        n_b = np.bincount(codes, minlength=len(self.groups)).astype(float)
+        sum_b = np.bincount(codes, weights=values, minlength=len(self.groups))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_b = np.where(n_b > 0, sum_b / n_b, 0.0)
+        m2_b = np.bincount(codes, weights=(values - mean_b[codes]) ** 2, minlength=len(self.groups))
+
+        total = self.count + n_b
+        delta = mean_b - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean = np.where(total > 0, self.mean + delta * n_b / total, 0.0)
+            self.m2 = self.m2 + m2_b + np.where(total > 0, delta ** 2 * self.count * n_b / total, 0.0)
+        self.count = total
+
+    @property
+    def variance(self):
+        """样本方差，少于2个观测时为NaN"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self.m2 / (self.count - 1), np.nan)
+
+
+def reached_precision(scored, population, width, precision, min_samples):
+    """停止条件：全部评论都已打分，或已打分数不少于min_samples且置信区间半宽不超过precision"""
+    return (scored >= population) | ((scored >= min_samples) & (width <= precision))
+
+
+def half_width(variance, n, population, confidence=0.95):
+    """
+    均值置信区间的半宽，含有限总体校正 sqrt((N - n) / (N - 1))：全部评论都打分后半宽为0
+
+    参数:
+    variance: 样本方差
+    n: 已打分数
+    population: 该组的评论总数
+    confidence: 置信水平
+    """
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fpc = np.where(population > 1, (population - n) / (population - 1), 0.0)
+        return z * np.sqrt(variance / n * np.clip(fpc, 0, 1))
+
+
+def progressive_estimate(df, text_column, score_func, group_column='宣传片ID', precision=0.01, confidence=0.95,
+                         batch_size=200, min_samples=30, random_state=42):
+    """
+    分层渐进抽样打分，直到每个组的置信区间半宽不超过precision
+
+    参数:
+    df: 输入数据
+    text_column: 评论内容列名
+    score_func: 打分函数，输入文本Series，返回等长的得分序列
+    group_column: 分层依据的列
+    precision: 目标精度（置信区间半宽）
+    confidence: 置信水平
+    batch_size: 每轮每组抽取的评论数
+    min_samples: 每组至少打分的评论数，避免样本过少时方差估计不稳定导致过早停止
+    random_state: 抽样的随机种子
+
+    返回:
+    tuple: (各组估计结果DataFrame, 已打分评论占全部评论的比例)
+    """
+    groups = pd.Index(df[group_column].dropna().unique()).sort_values()
+    codes = groups.get_indexer(df[group_column])
+    population = np.bincount(codes[codes >= 0], minlength=len(groups)).astype(float)
+
+    # 每组内的随机打分顺序：先整体随机打乱，再按组计算组内序号
+    rng = np.random.default_rng(random_state)
+    order = rng.permutation(len(df))
+    rank = np.empty(len(df), dtype=np.int64)
+    rank[order] = pd.Series(codes[order]).groupby(codes[order]).cumcount().to_numpy()
+
+    stats = RunningStats(groups)
+    scored = np.zeros(len(groups))
+    active = population > 0
+    texts = df[text_column]
+    round_index = 0
+    while active.any():
+        low, high = round_index * batch_size, (round_index + 1) * batch_size
+        selected = np.flatnonzero((codes >= 0) & (rank >= low) & (rank < high) & active[np.maximum(codes, 0)])
+        stats.update(codes[selected], score_func(texts.iloc[selected]))
+        scored += np.bincount(codes[selected], minlength=len(groups))
+
+        width = half_width(stats.variance, stats.count, population, confidence)
+        active &= ~reached_precision(scored, population, width, precision, min_samples)
+        round_index += 1
+        print(f"第 {round_index} 轮：已打分 {int(scored.sum())}/{int(population.sum())} 条，"
+              f"{int((~active).sum())}/{len(groups)} 个组已达到精度")
+
+    width = half_width(stats.variance, stats.count, population, confidence)
+    estimates = pd.DataFrame({
+        group_column: groups,
+        '评论总数': population.astype(int),
+        '已打分数': scored.astype(int),
+        '打分比例': scored / population,
+        '均值估计': stats.mean,
+        '标准差': np.sqrt(stats.variance),
+        '置信区间下限': stats.mean - width,
+        '置信区间上限': stats.mean + width,
+        '置信区间半宽': width,
+    })
+    estimates['达到精度'] = reached_precision(scored, population, width, precision, min_samples)
+
+    # 整体均值：按各组评论数加权的分层估计
+    weights = population / population.sum()
+    overall_mean = float(np.sum(weights * stats.mean))
+    overall_width = float(np.sqrt(np.nansum((weights * width) ** 2)))
+    overall = {
+        group_column: '全部', '评论总数': int(population.sum()), '已打分数': int(scored.sum()),
+        '打分比例': scored.sum() / population.sum(), '均值估计': overall_mean, '标准差': np.nan,
+        '置信区间下限': overall_mean - overall_width, '置信区间上限': overall_mean + overall_width,
+        '置信区间半宽': overall_width,
+        '达到精度': bool(reached_precision(scored.sum(), population.sum(), overall_width, precision, min_samples)),
+    }
+    estimates = pd.concat([estimates, pd.DataFrame([overall])], ignore_index=True)
+    return estimates, float(scored.sum() / population.sum())
+
+
+def estimate_sentiment(input_file, comment_column, output_file=None, output_config=None, group_column='宣传片ID',
+                       precision=0.01, confidence=0.95, batch_size=200, min_samples=30, random_state=42,
+                       scoring_mode='snownlp', processes=1, distilled_model_file=None):
+    """
+    对输入文件做渐进式近似情感估计，并写出各组的估计结果
+
+    参数:
+    input_file: 输入文件路径
+    comment_column: 评论内容列名
+    output_file: 估计结果输出路径（可选）
+    output_config: config.yaml中的output配置（可选）
+    group_column, precision, confidence, batch_size, min_samples, random_state: 见progressive_estimate
+    scoring_mode: 'snownlp' 使用SnowNLP批量打分；'distilled' 使用蒸馏模型；其他取值（如'cascade'）使用SnowNLP，
+                  结果的“打分模型”列记录实际使用的模型
+    processes: SnowNLP批量打分时分词使用的进程数
+    distilled_model_file: scoring_mode为'distilled'时使用的蒸馏模型路径
+
+    返回:
+    DataFrame: 各组估计结果，出错时返回None
+    """
+    try:
+        df = read_table(input_file)
+        if comment_column not in df.columns or group_column not in df.columns:
+            raise ValueError(f"未找到列名 '{comment_column}' 或 '{group_column}'")
+
+        if scoring_mode == 'distilled':
+            from src.distilled_model import DISTILLED_COLUMN, score_distilled
+
+            source = DISTILLED_COLUMN
+
+            def score_func(texts):
+                return score_distilled(texts, distilled_model_file)
+        else:
+            from src.snownlp_batch import get_batch_scorer
+
+            if scoring_mode != 'snownlp':
+                # 级联打分要为抽中的不确定评论逐批加载、调用Transformer模型，与近似估计少打分的目的相反
+                print(f"近似估计不支持打分方式 '{scoring_mode}'，改用SnowNLP打分")
+            source = 'SnowNLP'
+
+            def score_func(texts):
+                return get_batch_scorer().score(texts, processes=processes)
+
+        estimates, fraction = progressive_estimate(
+            df, comment_column, score_func, group_column, precision, confidence, batch_size, min_samples,
+            random_state
+        )
+        estimates['打分模型'] = source
+        print(f"\n使用{source}共打分 {fraction:.1%} 的评论")
+        print(estimates[[group_column, '已打分数', '打分比例', '均值估计', '置信区间半宽']].to_string(index=False))
+
+        if output_file:
+            output_file = resolve_output_path(output_file, 'sentiment_estimate', output_config)
+            write_table(estimates, output_file, 'sentiment_estimate', output_config)
+            print(f"估计结果已保存至: {output_file}")
+        return estimates
+    except Exception as e:
+        print(f"近似估计时出错: {str(e)}")
+        return None
@@ -7,12 +7,20 @@
 import pandas as pd
 from snownlp import SnowNLP
 import warnings
+
+from src.checkpoint import ErrorLog, ResultCheckpoint, report_error, score_with_checkpoint
+from src.distilled_model import score_distilled
+from src.output_writer import read_table, resolve_output_path, write_table
+from src.sharding import merge_shards, select_shard, shard_path
+from src.snownlp_batch import get_batch_scorer
+
 warnings.filterwarnings('ignore')
 
-def analyze_sentiment(text):
+def analyze_sentiment(text, error_log=None, row=None):
     """
     对输入的文本进行情感分析，返回情感得分
     得分范围：0-1，越接近1表示情感越正面
+    row为该文本在输入文件中的行号，出错时写入错误日志
     """
     try:
         # 处理空值情况
@@ -22,11 +30,29 @@ def analyze_sentiment(text):
         s = SnowNLP(str(text))
         return s.sentiments
     except Exception as e:
-        print(f"处理文本时出错: {text}")
-        print(f"错误信息: {str(e)}")
+        report_error(error_log, 'SnowNLP', text, e, row)
         return None
 
-def process_excel(input_file, comment_column, output_file=None):
+def analyze_sentiment_batch(texts, processes=1, error_log=None):
+    """
+    批量情感分析，结果与逐条调用analyze_sentiment一致，但只加载一次模型并向量化计算
+    
+    参数:
+    texts: 文本序列（索引为行号，写入错误日志）
+    processes: 分词使用的进程数
+    error_log: 错误日志（可选）
+    
+    返回:
+    np.ndarray: 每条文本的情感得分，空值为NaN
+    """
+    return get_batch_scorer().score(texts, processes=processes, error_log=error_log)
+
+
+def process_excel(input_file, comment_column, output_file=None, output_config=None,
+                  snownlp_backend='batch', processes=1,
+                  checkpoint_file=None, checkpoint_every=1000, resume=False, error_log_file=None,
+                  scoring_mode='snownlp', cascade_config=None, token_cache_dir=None, batch_size=32,
+                  shard=None, shard_key='fingerprint', distilled_model_file=None):
     """
     处理Excel文件中的评论数据
     
@@ -34,21 +60,85 @@ def process_excel(input_file, comment_column, output_file=None):
     input_file: 输入的Excel文件路径
     comment_column: 包含评论的列名
     output_file: 输出的Excel文件路径（可选）
+    output_config: config.yaml中的output配置，用于选择输出格式（可选）
+    snownlp_backend: 'batch' 使用向量化批量打分，'legacy' 逐条创建SnowNLP对象
+    processes: 批量打分时分词使用的进程数
+    checkpoint_file: 检查点文件路径（可选），指定后每checkpoint_every行追加写入一次结果
+    checkpoint_every: 写检查点的间隔行数
+    resume: 为True时从检查点继续，跳过已打分的行
+    error_log_file: 错误日志路径（可选），逐行打分的错误写入该文件
+    scoring_mode: 'snownlp' 只用SnowNLP打分；'cascade' 先用SnowNLP打分，不确定的评论再交给Transformer模型，
+                  并增加“打分模型”列记录每条得分的来源；'distilled' 使用从Transformer打分蒸馏出的线性模型
+    cascade_config: 级联打分配置（字典），包含low、high、model
+    token_cache_dir: 级联打分时Transformer模型的分词缓存目录（可选）
+    batch_size: 级联打分时Transformer模型的批次大小
+    shard: (分片编号, 分片总数)（可选），指定后只对该分片打分，结果写入分片文件，最后用merge_sentiment_shards合并
+    shard_key: 分片依据，'fingerprint'（评论指纹）或 'video'（宣传片ID）
+    distilled_model_file: scoring_mode为'distilled'时使用的蒸馏模型路径
     """
     try:
         # 读取Excel文件
-        df = pd.read_excel(input_file)
+        df = read_table(input_file)
         
         # 检查评论列是否存在
         if comment_column not in df.columns:
             raise ValueError(f"未找到列名 '{comment_column}'")
         
+        if shard:
+            df = select_shard(df, comment_column, shard, shard_key)
+        
+        error_log = ErrorLog(error_log_file, resume) if error_log_file else None
+        
+        if scoring_mode == 'cascade':
+            # 级联模式需要Transformer模型，按需导入
+            from src.sentiment_analysis_compare import SentimentAnalyzer
+            
+            cascade_config = cascade_config or {}
+            model_key = cascade_config.get('model', 'bert_wwm')
+            analyzer = SentimentAnalyzer(token_cache_dir=token_cache_dir, error_log=error_log)
+            if model_key == 'bert_wwm':
+                analyzer.init_bert_wwm_model()
+            else:
+                analyzer.init_weibo_model()
+        
+        def score(texts):
+            if scoring_mode == 'cascade':
+                scores, sources = analyzer.analyze_cascade(
+                    texts, cascade_config.get('low', 0.3), cascade_config.get('high', 0.7), model_key, batch_size
+                )
+                return pd.DataFrame({'得分': scores, '打分模型': sources})
+            if scoring_mode == 'distilled':
+                return score_distilled(texts, distilled_model_file)
+            if snownlp_backend == 'batch':
+                return analyze_sentiment_batch(texts, processes=processes, error_log=error_log)
+            return pd.Series([analyze_sentiment(text, error_log, row) for row, text in texts.items()], index=texts.index)
+        
         # 对评论进行情感分析
-        df['情感得分'] = df[comment_column].apply(analyze_sentiment)
+        if checkpoint_file:
+            # 打分方式不同的得分（及级联模式多出的“打分模型”列）不能混在同一个检查点中续跑
+            signature = {'scoring_mode': scoring_mode}
+            if scoring_mode == 'cascade':
+                signature.update(model=model_key, low=cascade_config.get('low', 0.3), high=cascade_config.get('high', 0.7))
+            checkpoint = ResultCheckpoint(checkpoint_file, resume, signature)
+            scored = score_with_checkpoint(df[comment_column], score, checkpoint, checkpoint_every)
+        else:
+            scored = score(df[comment_column])
+            scored = scored.set_index(df.index) if isinstance(scored, pd.DataFrame) \
+                else pd.DataFrame({'得分': scored}, index=df.index)
+        df['情感得分'] = scored['得分']
+        if '打分模型' in scored.columns:
+            df['打分模型'] = scored['打分模型']
+            print(f"级联打分升级比例: {(scored['打分模型'] != 'SnowNLP').mean():.1%}")
+        
+        if error_log is not None and error_log.count:
+            print(f"{error_log.count} 条评论打分出错，详见：{error_log_file}")
         
         # 如果指定了输出文件，则保存结果
         if output_file:
-            df.to_excel(output_file, index=False)
+            output_file = resolve_output_path(output_file, 'sentiment_output', output_config)
+            if shard:
+                output_file = shard_path(output_file, shard)
+            write_table(df, output_file, 'sentiment_output', output_config)
             print(f"结果已保存至: {output_file}")
         
         return df
@@ -57,6 +147,32 @@ def process_excel(input_file, comment_column, output_file=None):
         print(f"处理文件时出错: {str(e)}")
         return None
 
+
+def merge_sentiment_shards(input_file, comment_column, output_file, shard_count, output_config=None):
+    """
+    合并分片打分的结果，按输入文件的原始顺序写出完整的情感分析结果
+    
+    参数:
+    input_file: 分片打分时使用的输入文件，用于校验分片结果是否完整
+    comment_column: 包含评论的列名
+    output_file: 输出文件路径（与分片打分时的output_file相同）
+    shard_count: 分片总数
+    output_config: config.yaml中的output配置（可选）
+    
+    返回:
+    DataFrame: 合并后的结果，校验失败时返回None
+    """
+    try:
+        df = read_table(input_file)
+        output_file = resolve_output_path(output_file, 'sentiment_output', output_config)
+        merged = merge_shards(output_file, shard_count, df[comment_column])
+        write_table(merged, output_file, 'sentiment_output', output_config)
+        print(f"结果已保存至: {output_file}")
+        return merged
+    except Exception as e:
+        print(f"合并分片时出错: {str(e)}")
+        return None
+
 if __name__ == "__main__":
     # 使用示例
     input_file = "../处理后的评论汇总.xlsx"  # 输入文件名
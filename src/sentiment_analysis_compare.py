@@ -1,4 +1,5 @@
 import hanlp.pretrained
+import numpy as np
 import pandas as pd
 import torch
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
@@ -6,15 +7,38 @@ from transformers import AutoModelForSequenceClassification, AutoTokenizer
 from snownlp import SnowNLP
 import hanlp
 import emoji
+import os
 import re
+import time
 from tqdm import tqdm
 
+from src.checkpoint import (
+    ErrorLog, ResultCheckpoint, FINGERPRINT_COLUMN, ROW_COLUMN, report_error, score_with_checkpoint
+)
+from src.distilled_model import DISTILLED_COLUMN, load_distilled_model, training_fingerprints
+from src.output_writer import read_table, resolve_output_path, write_tables
+from src.sharding import merge_shards, select_shard, shard_path
+from src.snownlp_batch import get_batch_scorer
+from src.token_cache import TokenCache
+from src.utils import comment_fingerprint
+
+# Transformer模型的model_key与结果列名
+TRANSFORMER_COLUMNS = {'weibo': '微博模型', 'bert_wwm': 'BERT-WWM'}
+
 class SentimentAnalyzer:
     """情感分析器类，整合多个模型"""
     
-    def __init__(self):
+    def __init__(self, token_cache_dir=None, error_log=None):
+        """
+        参数:
+        token_cache_dir: 分词缓存目录（可选），指定后Transformer模型的分词结果会缓存到磁盘并在后续运行中复用
+        error_log: ErrorLog对象（可选），指定后逐条分析的错误写入错误日志而不是打印
+        """
         self.models = {}
         self.results = {}
+        self.token_cache_dir = token_cache_dir
+        self.token_caches = {}
+        self.error_log = error_log
     
     
     def preprocess_text(self, text):
@@ -81,6 +105,11 @@ class SentimentAnalyzer:
         self.models['bert_wwm'] = (model, tokenizer)
     
     
+    def init_distilled_model(self, model_file):
+        """加载蒸馏模型（字符n-gram TF-IDF + 逻辑回归，由 python main.py run distill 训练）"""
+        self.models['distilled'] = load_distilled_model(model_file)
+    
+    
     # def init_skep_model(self):
     #     """初始化SKEP模型"""
     #     self.models['skep'] = Taskflow("sentiment_analysis", model="skep_ernie_1.0_large_ch")
@@ -130,34 +159,159 @@ class SentimentAnalyzer:
             return probs[0][1].item()
             
         except Exception as e:
-            print(f"{model_key}处理文本时出错: {text}")
-            print(f"错误信息: {str(e)}")
+            report_error(self.error_log, model_key, text, e)
+            return None
+    
+    
+    def get_token_cache(self, model_key):
+        """获取指定Transformer模型的分词缓存，未配置缓存目录时返回None"""
+        if self.token_cache_dir is None:
             return None
+        if model_key not in self.token_caches:
+            _, tokenizer = self.models[model_key]
+            self.token_caches[model_key] = TokenCache(
+                self.token_cache_dir, tokenizer, max_length=512, preprocess=self.preprocess_text
+            )
+        return self.token_caches[model_key]
+    
+    
+    def _tokenize_batches(self, texts, tokenizer, batch_size):
+        """未启用分词缓存时，直接分词并按顺序分批"""
+        for start in range(0, len(texts), batch_size):
+            batch = [self.preprocess_text(text) for text in texts[start:start + batch_size]]
+            inputs = tokenizer(batch, padding=True, truncation=True, max_length=512, return_tensors='np')
+            yield list(range(start, start + len(batch))), inputs['input_ids'], inputs['attention_mask']
     
     
-    def analyze_with_skep(self, text):
+    def batch_analyze_with_transformer(self, texts, model_key, batch_size=32, rows=None):
+        """
+        使用Transformer模型批量分析
+        
+        参数:
+        texts: 文本列表
+        model_key: 模型键，如 'bert_wwm'
+        batch_size: 批次大小
+        rows: 每条文本在输入文件中的行号，写入错误日志（可选）
+        
+        返回:
+        list: 与texts一一对应的正面概率，出错的批次为None
+        """
+        model, tokenizer = self.models[model_key]
+        texts = list(texts)
+        scores = [None] * len(texts)
+        cache = self.get_token_cache(model_key)
+        if cache is not None:
+            batches = cache.iter_batches(texts, batch_size)
+        else:
+            batches = self._tokenize_batches(texts, tokenizer, batch_size)
+        
+        for positions, input_ids, attention_mask in batches:
+            try:
+                inputs = {
+                    'input_ids': torch.from_numpy(input_ids).long(),
+                    'attention_mask': torch.from_numpy(attention_mask).long()
+                }
+                if torch.cuda.is_available():
+                    inputs = {k: v.cuda() for k, v in inputs.items()}
+                
+                with torch.no_grad():
+                    outputs = model(**inputs)
+                
+                probs = torch.nn.functional.softmax(outputs.logits, dim=-1)[:, 1].tolist()
+                for position, prob in zip(positions, probs):
+                    scores[position] = prob
+            except Exception as e:
+                # 整批失败时每条文本各记录一次，便于按行排查
+                for position in positions:
+                    report_error(self.error_log, model_key, texts[position], e,
+                                 None if rows is None else rows[position])
+        return scores
+    
+    
+    def encode_texts(self, texts, model_key='bert_wwm', batch_size=32, pooling='mean'):
+        """
+        使用Transformer模型最后一层隐藏状态批量编码文本
+    
+        参数:
+        texts: 文本列表
+        model_key: 模型键，如 'bert_wwm'
+        batch_size: 批次大小
+        pooling: 'mean' 按attention_mask对全部token取平均；'cls' 取[CLS]位置的向量
+    
+        返回:
+        np.ndarray: 形状为 (len(texts), hidden_size) 的float32数组，与texts一一对应
+        """
+        model, tokenizer = self.models[model_key]
+        texts = list(texts)
+        vectors = np.zeros((len(texts), model.config.hidden_size), dtype=np.float32)
+        cache = self.get_token_cache(model_key)
+        if cache is not None:
+            batches = cache.iter_batches(texts, batch_size)
+        else:
+            batches = self._tokenize_batches(texts, tokenizer, batch_size)
+    
+        for positions, input_ids, attention_mask in batches:
+            inputs = {
+                'input_ids': torch.from_numpy(input_ids).long(),
+                'attention_mask': torch.from_numpy(attention_mask).long()
+            }
+            if torch.cuda.is_available():
+                inputs = {k: v.cuda() for k, v in inputs.items()}
+    
+            with torch.no_grad():
+                hidden = model(**inputs, output_hidden_states=True).hidden_states[-1]
+    
+            if pooling == 'cls':
+                pooled = hidden[:, 0]
+            else:
+                mask = inputs['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            vectors[positions] = pooled.float().cpu().numpy()
+        return vectors
+    
+    
+    def analyze_with_distilled(self, text, row=None):
+        """使用蒸馏模型进行分析"""
+        try:
+            return float(self.models['distilled'].predict_proba([text])[0, 1])
+        except Exception as e:
+            report_error(self.error_log, DISTILLED_COLUMN, text, e, row)
+            return None
+    
+    
+    def batch_analyze_with_distilled(self, texts, rows=None):
+        """使用蒸馏模型批量分析，一次稀疏矩阵乘法得到整批得分；rows为每条文本的行号（可选）"""
+        texts = list(texts)
+        try:
+            scores = self.models['distilled'].predict_proba(texts)[:, 1]
+        except Exception as e:
+            for i, text in enumerate(texts):
+                report_error(self.error_log, DISTILLED_COLUMN, text, e, None if rows is None else rows[i])
+            return [None] * len(texts)
+        return [None if pd.isna(text) else float(score) for text, score in zip(texts, scores)]
+    
+    
+    def analyze_with_skep(self, text, row=None):
         """使用SKEP模型进行分析"""
         try:
             result = self.models['skep'](self.preprocess_text(text))
             return result[0]['score']
         except Exception as e:
-            print(f"SKEP处理文本时出错: {text}")
-            print(f"错误信息: {str(e)}")
+            report_error(self.error_log, 'SKEP', text, e, row)
             return None
     
     
-    def analyze_with_paddle(self, text):
+    def analyze_with_paddle(self, text, row=None):
         """使用PaddleNLP模型进行分析"""
         try:
             result = self.models['paddle'](self.preprocess_text(text))
             return result[0]['probability']
         except Exception as e:
-            print(f"PaddleNLP处理文本时出错: {text}")
-            print(f"错误信息: {str(e)}")
+            report_error(self.error_log, 'PaddleNLP', text, e, row)
             return None
     
     
-    def analyze_with_hanlp(self, text):
+    def analyze_with_hanlp(self, text, row=None):
         """使用HanLP模型进行分析"""
         try:
             if self.models['hanlp'] is None:
@@ -177,8 +331,7 @@ class SentimentAnalyzer:
             return result['positive'] if 'positive' in result else 0.5
             
         except Exception as e:
-            print(f"HanLP处理文本时出错: {text}")
-            print(f"错误信息: {str(e)}")
+            report_error(self.error_log, 'HanLP', text, e, row)
             return None
     
     
@@ -188,11 +341,17 @@ class SentimentAnalyzer:
             s = SnowNLP(self.preprocess_text(text))
             return s.sentiments
         except Exception as e:
-            print(f"SnowNLP处理文本时出错: {text}")
-            print(f"错误信息: {str(e)}")
+            report_error(self.error_log, 'SnowNLP', text, e)
             return None
     
     
+    def batch_analyze_with_snownlp(self, texts, rows=None):
+        """使用向量化的SnowNLP模型批量分析，结果与analyze_with_snownlp一致；rows为每条文本的行号（可选）"""
+        scores = get_batch_scorer().score([self.preprocess_text(text) for text in texts], error_log=self.error_log,
+                                          rows=rows)
+        return [None if pd.isna(score) else float(score) for score in scores]
+    
+    
     def analyze_text(self, text):
         """使用所有模型分析文本"""
         results = {'评论内容': text}
@@ -203,6 +362,9 @@ class SentimentAnalyzer:
         if 'bert_wwm' in self.models:
             results['BERT-WWM'] = self.analyze_with_transformer(text, 'bert_wwm')
         
+        if 'distilled' in self.models:
+            results[DISTILLED_COLUMN] = self.analyze_with_distilled(text)
+        
         if 'skep' in self.models:
             results['SKEP'] = self.analyze_with_skep(text)
         
@@ -216,9 +378,166 @@ class SentimentAnalyzer:
         results['SnowNLP'] = self.analyze_with_snownlp(text)
         
         return results
+    
+    
+    def analyze_texts(self, texts, batch_size=32):
+        """
+        使用所有模型批量分析文本，Transformer模型和蒸馏模型按批次推理，其余模型逐条分析
+        
+        参数:
+        texts: 文本序列，为Series时其索引作为行号写入错误日志
+        batch_size: Transformer模型的批次大小
+        
+        返回:
+        list: 每条文本一个结果字典，列与analyze_text一致
+        """
+        rows = list(texts.index) if isinstance(texts, pd.Series) else None
+        texts = list(texts)
+        batch_scores = {
+            column: self.batch_analyze_with_transformer(texts, model_key, batch_size, rows)
+            for model_key, column in TRANSFORMER_COLUMNS.items() if model_key in self.models
+        }
+        if 'distilled' in self.models:
+            batch_scores[DISTILLED_COLUMN] = self.batch_analyze_with_distilled(texts, rows)
+        snownlp_scores = self.batch_analyze_with_snownlp(texts, rows)
+        
+        results = []
+        for i, text in enumerate(tqdm(texts)):
+            result = {'评论内容': text}
+            for column, scores in batch_scores.items():
+                result[column] = scores[i]
+            row = None if rows is None else rows[i]
+            if 'skep' in self.models:
+                result['SKEP'] = self.analyze_with_skep(text, row)
+            if 'paddle' in self.models:
+                result['PaddleNLP'] = self.analyze_with_paddle(text, row)
+            if 'hanlp' in self.models:
+                result['HanLP'] = self.analyze_with_hanlp(text, row)
+            result['SnowNLP'] = snownlp_scores[i]
+            results.append(result)
+        return results
+
+
+    def analyze_cascade(self, texts, low=0.3, high=0.7, model_key='bert_wwm', batch_size=32):
+        """
+        级联打分：所有评论先用SnowNLP打分，只有得分落在不确定区间[low, high]内（或SnowNLP打分失败）的评论
+        才交给Transformer模型批量打分
+        
+        参数:
+        texts: 文本序列，为Series时其索引作为行号写入错误日志
+        low, high: 不确定区间的上下界
+        model_key: 升级使用的Transformer模型键
+        batch_size: Transformer模型的批次大小
+        
+        返回:
+        tuple: (scores, sources)，sources为每条评论最终得分来自的模型名称
+        """
+        rows = list(texts.index) if isinstance(texts, pd.Series) else None
+        texts = list(texts)
+        scores = self.batch_analyze_with_snownlp(texts, rows)
+        sources = ['SnowNLP'] * len(texts)
+        escalate = [i for i, score in enumerate(scores) if score is None or low <= score <= high]
+        
+        if escalate and model_key in self.models:
+            escalated = self.batch_analyze_with_transformer(
+                [texts[i] for i in escalate], model_key, batch_size, None if rows is None else [rows[i] for i in escalate]
+            )
+            for i, score in zip(escalate, escalated):
+                if score is not None:
+                    scores[i] = score
+                    sources[i] = TRANSFORMER_COLUMNS[model_key]
+        return scores, sources
+
+
+def evaluate_cascade(input_file, text_column='评论内容', sample_size=None, low=0.3, high=0.7,
+                     model_key='bert_wwm', output_file='级联打分评估.xlsx', output_config=None,
+                     token_cache_dir=None, batch_size=32, random_state=None):
+    """
+    在与compare_models相同的样本上评估级联打分：升级比例、节省的时间、与全量Transformer打分的一致性
+    
+    参数:
+    input_file: 输入文件路径
+    text_column: 文本评论对应的列名
+    sample_size: 采样数量，与comparison_sample_size一致时使用同一批样本
+    low, high: 不确定区间的上下界
+    model_key: 升级使用的Transformer模型键
+    output_file: 评估结果输出路径
+    output_config: config.yaml中的output配置（可选）
+    token_cache_dir: 分词缓存目录（可选）
+    batch_size: Transformer模型的批次大小
+    random_state: 采样的随机种子
+    
+    返回:
+    tuple: (逐条结果DataFrame, 汇总指标DataFrame)
+    """
+    df = read_table(input_file)
+    if sample_size:
+        df = df.sample(n=min(sample_size, len(df)), random_state=random_state)
+    texts = df[text_column].tolist()
+    
+    analyzer = SentimentAnalyzer(token_cache_dir=token_cache_dir)
+    if model_key == 'bert_wwm':
+        analyzer.init_bert_wwm_model()
+    else:
+        analyzer.init_weibo_model()
+    column = TRANSFORMER_COLUMNS[model_key]
+    
+    # 两种方式从相同的状态开始计时：启用分词缓存时先把全部样本写入缓存（未启用时两者都在计时内分词），
+    # 再预热Transformer模型并加载SnowNLP模型，首次推理和加载模型的时间不计入对比
+    cache = analyzer.get_token_cache(model_key)
+    if cache is not None:
+        cache.encode(texts)
+    analyzer.batch_analyze_with_transformer(texts[:batch_size], model_key, batch_size)
+    get_batch_scorer()
+    
+    start = time.perf_counter()
+    baseline = analyzer.batch_analyze_with_transformer(texts, model_key, batch_size)
+    baseline_seconds = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    scores, sources = analyzer.analyze_cascade(texts, low, high, model_key, batch_size)
+    cascade_seconds = time.perf_counter() - start
+    
+    results_df = pd.DataFrame({
+        '评论内容': texts,
+        column: baseline,
+        '级联得分': scores,
+        '级联来源': sources,
+    })
+    valid = results_df[[column, '级联得分']].notna().all(axis=1)
+    compared = results_df[valid]
+    escalation_rate = (results_df['级联来源'] == column).mean()
+    # 数值列只放数字（parquet要求整列类型一致），单位单独成列
+    summary = pd.DataFrame([
+        ('样本数', len(results_df), '条'),
+        ('不确定区间下界', low, '得分'),
+        ('不确定区间上界', high, '得分'),
+        ('升级比例', escalation_rate, '比例'),
+        (f'全量{column}耗时', baseline_seconds, '秒'),
+        ('级联耗时', cascade_seconds, '秒'),
+        ('节省时间', baseline_seconds - cascade_seconds, '秒'),
+        ('节省比例', 1 - cascade_seconds / baseline_seconds if baseline_seconds else np.nan, '比例'),
+        ('正负倾向一致率', ((compared[column] >= 0.5) == (compared['级联得分'] >= 0.5)).mean(), '比例'),
+        ('平均绝对误差', (compared[column] - compared['级联得分']).abs().mean(), '得分'),
+        ('相关系数', compared[column].corr(compared['级联得分']), ''),
+    ], columns=['指标', '数值', '单位'])
+    summary['数值'] = summary['数值'].astype(float)
+    
+    output_file = resolve_output_path(output_file, 'cascade_evaluation', output_config)
+    write_tables({'详细结果': results_df, '汇总指标': summary}, output_file, 'cascade_evaluation', output_config)
+    
+    print(f"\n结果已保存至: {output_file}")
+    print("\n级联打分评估:")
+    print(summary.to_string(index=False))
+    
+    return results_df, summary
 
 
-def compare_models(input_file, text_column='评论内容', sample_size=None):
+def compare_models(input_file, text_column='评论内容', sample_size=None,
+                   output_file='模型对比结果.xlsx', output_config=None,
+                   token_cache_dir=None, batch_size=32, random_state=None,
+                   checkpoint_file=None, checkpoint_every=1000, resume=False, error_log_file=None,
+                   shard=None, shard_key='fingerprint', distilled_model_file=None):
     """
     比较多个模型的情感分析结果
     
@@ -226,40 +545,117 @@ def compare_models(input_file, text_column='评论内容', sample_size=None):
     input_file: 输入文件路径
     text_column: 文本评论对应的列名
     sample_size: 采样数量，如果不指定则处理所有数据
+    output_file: 对比结果输出路径
+    output_config: config.yaml中的output配置，用于选择输出格式（可选）
+    token_cache_dir: 分词缓存目录（可选），重复实验时跳过Transformer分词
+    batch_size: Transformer模型的批次大小
+    random_state: 采样的随机种子，断点续跑时必须固定，保证两次运行抽到同一批样本
+    checkpoint_file: 检查点文件路径（可选），指定后每checkpoint_every行追加写入一次结果
+    checkpoint_every: 写检查点的间隔行数
+    resume: 为True时从检查点继续，跳过已分析的行
+    error_log_file: 错误日志路径（可选），逐条分析的错误写入该文件
+    shard: (分片编号, 分片总数)（可选），指定后只分析样本中属于该分片的行，结果写入分片文件，
+           最后用merge_comparison_shards合并；各分片必须使用相同的sample_size和random_state
+    shard_key: 分片依据，'fingerprint'（评论指纹）或 'video'（宣传片ID）
+    distilled_model_file: 蒸馏模型路径（可选），文件存在时对比结果增加“蒸馏模型”列；参与过蒸馏训练的评论在该列
+                          为空，避免训练集上的结果夸大与教师模型的一致性
     """
     # 读取数据
-    df = pd.read_excel(input_file)
+    df = read_table(input_file)
     if sample_size:
-        df = df.sample(n=min(sample_size, len(df)))
+        df = df.sample(n=min(sample_size, len(df)), random_state=random_state)
+    if shard:
+        df = select_shard(df, text_column, shard, shard_key)
     
     # 初始化分析器
-    analyzer = SentimentAnalyzer()
+    error_log = ErrorLog(error_log_file, resume) if error_log_file else None
+    analyzer = SentimentAnalyzer(token_cache_dir=token_cache_dir, error_log=error_log)
     analyzer.init_all_models()
+    if distilled_model_file and os.path.exists(distilled_model_file):
+        print("加载蒸馏模型...")
+        analyzer.init_distilled_model(distilled_model_file)
     
     # 分析文本
     print("开始分析文本...")
-    results = []
-    for text in tqdm(df[text_column]):
-        result = analyzer.analyze_text(text)
-        results.append(result)
+    if checkpoint_file:
+        # 检查点中不保存评论原文，结果按行号与原数据对齐
+        def score(texts):
+            return pd.DataFrame(analyzer.analyze_texts(texts, batch_size=batch_size)).drop(columns=['评论内容'])
+        
+        # 参与对比的模型不同（如蒸馏模型训练前后）时结果列不同，不能在同一个检查点中续跑
+        checkpoint = ResultCheckpoint(checkpoint_file, resume, {'models': sorted(analyzer.models)})
+        scored = score_with_checkpoint(df[text_column], score, checkpoint, checkpoint_every)
+        scored.insert(0, '评论内容', df[text_column])
+        results = scored.to_dict('records')
+    else:
+        results = analyzer.analyze_texts(df[text_column], batch_size=batch_size)
+    if error_log is not None and error_log.count:
+        print(f"{error_log.count} 条评论分析出错，详见：{error_log_file}")
+    
+    # 打印token长度分布，供选择批次大小参考
+    for model_key, cache in analyzer.token_caches.items():
+        print(f"{model_key} token长度统计: {cache.length_stats(df[text_column])}")
     
     # 转换结果为DataFrame
     results_df = pd.DataFrame(results)
-    
-    # 计算统计信息
-    model_columns = list(results[0].keys()) if results else []
+    if DISTILLED_COLUMN in results_df.columns:
+        trained = df[text_column].map(comment_fingerprint).isin(training_fingerprints(distilled_model_file)).to_numpy()
+        results_df.loc[trained, DISTILLED_COLUMN] = np.nan
+        print(f"蒸馏模型列只保留未参与训练的评论：{int((~trained).sum())}/{len(trained)} 条")
+    
+    output_file = resolve_output_path(output_file, 'model_comparison', output_config)
+    if shard:
+        # 分片结果只保存逐条结果，统计信息在合并后统一计算
+        results_df.insert(0, FINGERPRINT_COLUMN, df[FINGERPRINT_COLUMN].values)
+        results_df.insert(0, ROW_COLUMN, df[ROW_COLUMN].values)
+        output_file = shard_path(output_file, shard)
+        write_tables({'详细结果': results_df}, output_file, 'model_comparison', output_config)
+        print(f"\n分片结果已保存至: {output_file}")
+        return results_df, None
+    
+    stats = save_comparison(results_df, output_file, output_config)
+    return results_df, stats
+
+
+def save_comparison(results_df, output_file, output_config=None):
+    """计算各模型得分的统计信息，并与逐条结果一起写出"""
+    model_columns = [col for col in results_df.columns if col != '评论内容']
     stats = results_df[model_columns].agg(['mean', 'std', 'min', 'max'])
     
-    # 保存结果
-    output_file = '模型对比结果.xlsx'
-    with pd.ExcelWriter(output_file) as writer:
-        results_df.to_excel(writer, sheet_name='详细结果', index=False)
-        stats.to_excel(writer, sheet_name='统计信息')
+    write_tables(
+        {'详细结果': results_df, '统计信息': stats.rename_axis('统计量').reset_index()},
+        output_file, 'model_comparison', output_config
+    )
     
     print(f"\n结果已保存至: {output_file}")
     print("\n模型统计信息:")
     print(stats)
+    return stats
+
+
+def merge_comparison_shards(input_file, shard_count, text_column='评论内容', sample_size=None,
+                            random_state=None, output_file='模型对比结果.xlsx', output_config=None):
+    """
+    合并分片运行的模型对比结果，按样本原始顺序写出并重新计算统计信息
+    
+    参数:
+    input_file: 输入文件路径
+    shard_count: 分片总数
+    text_column: 文本评论对应的列名
+    sample_size, random_state: 必须与分片运行时一致，用于重建样本并校验分片结果是否完整
+    output_file: 对比结果输出路径（与分片运行时相同）
+    output_config: config.yaml中的output配置（可选）
+    
+    返回:
+    tuple: (逐条结果DataFrame, 统计信息DataFrame)
+    """
+    df = read_table(input_file)
+    if sample_size:
+        df = df.sample(n=min(sample_size, len(df)), random_state=random_state)
     
+    output_file = resolve_output_path(output_file, 'model_comparison', output_config)
+    results_df = merge_shards(output_file, shard_count, df[text_column])
+    stats = save_comparison(results_df, output_file, output_config)
     return results_df, stats
 
 
@@ -0,0 +1,330 @@
+"""
+文件功能：情感得分的预聚合立方体。按宣传片ID、是否AI生成、景区所在地、景区类型、是否本地评论、是否主评论的
+        每一种维度组合保存数量、总和、平方和与得分直方图，新打分的评论增量累加；均值、方差和分组对比直接从
+        立方体计算，不再重新读取逐条的情感分析结果
+"""
+
+import json
+import math
+import os
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from src.output_writer import read_table, resolve_output_path, write_table
+from src.utils import comment_fingerprint
+
+CUBE_DIMENSIONS = ['宣传片ID', '是否AI生成', '景区所在地', '景区类型', '是否本地评论', '是否主评论']
+ALL = '全部'  # 立方体中表示“该维度已汇总”的取值
+KEY_BYTES = 16
+MEASURES = ['数量', '总和', '平方和']
+
+
+KEY_COLUMNS = ['评论时间', 'IP地址']  # 与维度列、评论内容一起标识一条评论
+
+
+def row_keys(df, text_column='评论内容'):
+    """
+    计算每条评论的唯一标识，用于增量更新时去重
+
+    评论时间只精确到天，同一天同一视频下可能有内容完全相同的多条评论，因此在行内容的指纹之外再加上
+    它在相同内容中的出现序号：重复读取同一个文件（或在其后追加了新评论的文件）得到的标识不变
+
+    返回:
+    Series: 与df索引对齐的16位十六进制标识
+    """
+    columns = [col for col in CUBE_DIMENSIONS + KEY_COLUMNS + [text_column] if col in df.columns]
+    content = df[columns].astype(str).agg('\x1f'.join, axis=1)
+    occurrence = content.groupby(content).cumcount()
+    return (content + '\x1f' + occurrence.astype(str)).map(comment_fingerprint)
+
+
+def score_digest(keys, scores):
+    """
+    (评论标识, 得分)的摘要：逐行哈希后求和（对2^64取模），与行顺序无关，可以随新评论增量累加
+
+    同一批评论重新打分（打分方式或模型变化）后得分不同，摘要随之变化，据此判断立方体需要全量重建
+
+    返回:
+    int: 摘要值
+    """
+    rows = keys + ':' + scores.astype(float).map(float.hex)
+    return sum(int(digest, 16) for digest in rows.map(comment_fingerprint)) % 2 ** 64
+
+
+class SentimentCube:
+    """
+    情感得分立方体，保存为一张表：维度列（已汇总的维度取值为“全部”）+ 数量、总和、平方和、直方图列
+    另有两个辅助文件：已累加评论的标识（keys_file）和记录评论数、得分摘要与直方图区间数的元数据（keys_file同名的.meta.json）
+    """
+
+    def __init__(self, cube_file, keys_file, dimensions=None, bins=10, output_config=None):
+        """
+        参数:
+        cube_file: 立方体文件路径（格式由output.formats.sentiment_cube决定）
+        keys_file: 已累加评论的标识文件，用于增量更新时去重
+        dimensions: 维度列，默认CUBE_DIMENSIONS
+        bins: 得分直方图在[0, 1]上的等宽区间数
+        output_config: config.yaml中的output配置（可选）
+        """
+        self.cube_file = resolve_output_path(cube_file, 'sentiment_cube', output_config)
+        self.keys_file = keys_file
+        self.meta_file = os.path.splitext(keys_file)[0] + '.meta.json'
+        self.dimensions = list(dimensions or CUBE_DIMENSIONS)
+        self.bins = bins
+        self.output_config = output_config
+        self.hist_columns = [f"直方图[{i / bins:.2f},{(i + 1) / bins:.2f})" for i in range(bins)]
+        self.load()
+
+    def load(self):
+        """
+        读取已有的立方体、已累加评论的标识和元数据，三者不一致（上次写入中途中断）或直方图区间数与bins不同时
+        清空后重建
+        """
+        self._load_files()
+        if (self.keys or len(self.cube)) and not self._consistent():
+            print("情感立方体与已累加评论的标识不一致（上次更新可能中途中断），将全量重建")
+            self.reset()
+        elif len(self.cube) and not self._same_bins():
+            print(f"情感立方体的直方图区间数与当前设置（{self.bins}）不同，将全量重建")
+            self.reset()
+
+    def _load_files(self):
+        if os.path.exists(self.cube_file):
+            cube = read_table(self.cube_file, dtype={dim: str for dim in self.dimensions})
+            for dim in self.dimensions:
+                cube[dim] = cube[dim].astype(str)
+            self.cube = cube.set_index(self.dimensions)
+        else:
+            self.cube = pd.DataFrame(
+                columns=self.dimensions + MEASURES + self.hist_columns
+            ).set_index(self.dimensions)
+        self.keys = set()
+        if not os.path.exists(self.cube_file):
+            # 立方体文件被删除时，已累加的标识和元数据也随之失效
+            for path in (self.keys_file, self.meta_file):
+                if os.path.exists(path):
+                    os.remove(path)
+        if os.path.exists(self.keys_file):
+            keys = np.fromfile(self.keys_file, dtype=f'S{KEY_BYTES}')
+            self.keys = {key.decode('ascii') for key in keys.tolist()}
+        self.meta = {'rows': 0, 'score_digest': 0, 'bins': self.bins}
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file, encoding='utf-8') as f:
+                self.meta = json.load(f)
+
+    def _consistent(self):
+        """立方体中的总评论数、标识数和元数据中记录的评论数一致"""
+        total = self._cuboid([], {})
+        total_rows = int(float(total['数量'].iloc[0])) if len(total) else 0
+        return total_rows == len(self.keys) == self.meta.get('rows')
+
+    def _same_bins(self):
+        """已有立方体的直方图区间与bins一致"""
+        return self.meta.get('bins') == self.bins and all(column in self.cube.columns for column in self.hist_columns)
+
+    def reset(self):
+        """清空立方体、已累加评论的标识和元数据（打分方式变化后需要全量重建）"""
+        for path in (self.cube_file, self.keys_file, self.meta_file):
+            if os.path.exists(path):
+                os.remove(path)
+        self._load_files()
+
+    def _aggregate(self, df, score_column):
+        """对一批新评论计算所有维度组合的数量、总和、平方和与直方图"""
+        scores = df[score_column].astype(float)
+        base = df[self.dimensions].astype(str)
+        base['数量'] = 1
+        base['总和'] = scores
+        base['平方和'] = scores ** 2
+        bin_index = np.clip((scores * self.bins).astype(int), 0, self.bins - 1)
+        for i, column in enumerate(self.hist_columns):
+            base[column] = (bin_index == i).astype(int)
+
+        cuboids = []
+        measure_columns = MEASURES + self.hist_columns
+        for size in range(len(self.dimensions) + 1):
+            for group in combinations(self.dimensions, size):
+                if group:
+                    cuboid = base.groupby(list(group))[measure_columns].sum().reset_index()
+                else:
+                    cuboid = base[measure_columns].sum().to_frame().T
+                for dim in self.dimensions:
+                    if dim not in group:
+                        cuboid[dim] = ALL
+                cuboids.append(cuboid)
+        return pd.concat(cuboids, ignore_index=True).set_index(self.dimensions)[measure_columns]
+
+    def update(self, df, score_column='情感得分', text_column='评论内容'):
+        """
+        把尚未累加过的评论加入立方体，没有得分的评论不计入
+
+        参数:
+        df: 情感分析结果
+        score_column: 得分列名
+        text_column: 评论内容列名
+
+        返回:
+        int: 本次新累加的评论数
+        """
+        df = df[df[score_column].notna()]
+        keys = row_keys(df, text_column) if len(df) else pd.Series(dtype=str)
+        new = ~keys.isin(self.keys)
+        if self.keys and score_digest(keys[~new], df.loc[~new, score_column]) != int(self.meta['score_digest']):
+            # 已累加过的评论得分变了（重新打分）或已不在结果中，增量结果不再可靠
+            print("已累加评论的得分与本次结果不一致（打分方式或模型可能已变化），全量重建情感立方体")
+            self.reset()
+            new = pd.Series(True, index=keys.index)
+        if not new.any():
+            return 0
+
+        delta = self._aggregate(df[new], score_column)
+        self.cube = delta.add(self.cube.astype(float), fill_value=0) if len(self.cube) else delta
+        self.cube = self.cube.sort_index()
+        self.meta = {
+            'rows': len(self.keys) + int(new.sum()),
+            'score_digest': (int(self.meta['score_digest']) + score_digest(keys[new], df.loc[new, score_column]))
+                            % 2 ** 64,
+            'bins': self.bins,
+        }
+        # 依次写入立方体、元数据（都先写临时文件再替换），最后追加标识；任一步中断都会在下次读取时发现
+        # 三者记录的评论数不一致并重建
+        self.save()
+        os.makedirs(os.path.dirname(os.path.abspath(self.keys_file)), exist_ok=True)
+        with open(self.keys_file, 'ab') as f:
+            np.array(keys[new].tolist(), dtype=f'S{KEY_BYTES}').tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        self.keys.update(keys[new])
+        return int(new.sum())
+
+    def save(self):
+        """写出立方体和元数据"""
+        cube = self.cube.reset_index()
+        cube[MEASURES[:1] + self.hist_columns] = cube[MEASURES[:1] + self.hist_columns].astype(int)
+        stem, ext = os.path.splitext(self.cube_file)
+        temp_file = f"{stem}.tmp{ext}"
+        write_table(cube, temp_file, 'sentiment_cube', self.output_config)
+        os.replace(temp_file, self.cube_file)
+        with open(self.meta_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        os.replace(self.meta_file + '.tmp', self.meta_file)
+
+    def _cuboid(self, dims, filters):
+        """取出指定维度组合对应的立方体切片"""
+        dims = list(dims) + [dim for dim in filters if dim not in dims]
+        unknown = [dim for dim in dims if dim not in self.dimensions]
+        if unknown:
+            raise ValueError(f"立方体中没有维度 {', '.join(unknown)}，可选：{', '.join(self.dimensions)}")
+        cube = self.cube.reset_index()
+        mask = np.ones(len(cube), dtype=bool)
+        for dim in self.dimensions:
+            mask &= (cube[dim] != ALL) if dim in dims else (cube[dim] == ALL)
+        for dim, value in filters.items():
+            mask &= cube[dim] == str(value)
+        return cube[mask]
+
+    def query(self, by=(), filters=None):
+        """
+        按维度分组查询数量、均值、方差和标准差
+
+        参数:
+        by: 分组维度列表，为空时返回整体结果
+        filters: 筛选条件，例如 {'是否AI生成': 1}
+
+        返回:
+        DataFrame: 每组一行
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        filters = filters or {}
+        cuboid = self._cuboid(by, filters)
+        n = cuboid['数量'].astype(float)
+        mean = cuboid['总和'] / n
+        # 样本方差：(Σx² - (Σx)²/n) / (n - 1)
+        variance = (cuboid['平方和'] - cuboid['总和'] ** 2 / n) / (n - 1)
+        result = cuboid[by + list(filters)].copy()
+        result['数量'] = n.astype(int)
+        result['均值'] = mean
+        result['方差'] = variance.where(n > 1).clip(lower=0)
+        result['标准差'] = np.sqrt(result['方差'])
+        for column in self.hist_columns:
+            result[column] = cuboid[column].astype(int)
+        return result.reset_index(drop=True)
+
+    def compare(self, dimension, filters=None):
+        """
+        比较某个维度各取值组之间的平均得分：每组与其余各组的均值差、Welch t统计量和（正态近似的）双侧p值
+
+        参数:
+        dimension: 分组维度，例如 '是否AI生成'
+        filters: 筛选条件（可选）
+
+        返回:
+        DataFrame: 每组一行
+        """
+        filters = filters or {}
+        groups = self._cuboid([dimension], filters)
+        total = self._cuboid([], filters)
+        if total.empty:
+            return pd.DataFrame()
+        total_n, total_sum, total_sq = (float(total[column].iloc[0]) for column in MEASURES)
+
+        rows = []
+        for _, group in groups.iterrows():
+            n, s, sq = float(group['数量']), float(group['总和']), float(group['平方和'])
+            rest_n, rest_s, rest_sq = total_n - n, total_sum - s, total_sq - sq
+            row = {dimension: group[dimension], '数量': int(n), '均值': s / n, '其余组均值': np.nan,
+                   '均值差': np.nan, 't统计量': np.nan, 'p值': np.nan}
+            if n > 1 and rest_n > 1:
+                var = max((sq - s ** 2 / n) / (n - 1), 0)
+                rest_var = max((rest_sq - rest_s ** 2 / rest_n) / (rest_n - 1), 0)
+                se = math.sqrt(var / n + rest_var / rest_n)
+                row['其余组均值'] = rest_s / rest_n
+                row['均值差'] = row['均值'] - row['其余组均值']
+                if se > 0:
+                    row['t统计量'] = row['均值差'] / se
+                    row['p值'] = math.erfc(abs(row['t统计量']) / math.sqrt(2))
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+
+def update_sentiment_cube(sentiment_file, cube_file, keys_file, output_config=None, rebuild=False,
+                          score_column='情感得分', text_column='评论内容', bins=10):
+    """
+    把情感分析结果中的新评论累加到立方体
+
+    参数:
+    sentiment_file: 情感分析结果文件
+    cube_file: 立方体文件路径
+    keys_file: 已累加评论的标识文件
+    output_config: config.yaml中的output配置（可选）
+    rebuild: 为True时清空后全量重建（已累加评论的得分变化时会自动重建，一般不需要设置）
+    score_column: 得分列名
+    text_column: 评论内容列名
+    bins: 得分直方图区间数
+
+    返回:
+    SentimentCube: 更新后的立方体，读取失败时返回None
+    """
+    try:
+        cube = SentimentCube(cube_file, keys_file, bins=bins, output_config=output_config)
+        if rebuild:
+            cube.reset()
+        df = read_table(sentiment_file)
+        added = cube.update(df, score_column, text_column)
+        print(f"立方体新增 {added} 条评论，累计 {len(cube.keys)} 条: {cube.cube_file}")
+        print("\n各宣传片平均情感得分:")
+        print(cube.query(['宣传片ID'])[['宣传片ID', '数量', '均值', '标准差']].to_string(index=False))
+        return cube
+    except Exception as e:
+        print(f"更新情感立方体时出错: {str(e)}")
+        return None
+
+
+if __name__ == "__main__":
+    # 使用示例
+    cube = update_sentiment_cube("情感分析结果.xlsx", "情感立方体.xlsx", "./.cache/sentiment_cube_keys.bin")
+    if cube is not None:
+        print(cube.query(['景区类型', '是否AI生成']))
+        print(cube.compare('是否AI生成'))
@@ -0,0 +1,210 @@
+"""
+文件功能：按宣传片逐日统计情感得分的时间序列。以评论时间差（距视频发布的天数）为时间轴，把打分结果汇总为
+        每个视频每天的评论数和得分总和，补齐没有评论的日期后计算滚动平均、累计评论数和衰减曲线；
+        所有计算都是分组后的向量化运算，不对视频逐个循环。结果以长表（视频、天、指标、数值）输出，
+        增量更新时只重新汇总新评论涉及的视频、从其中最早的一天起的日期
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.output_writer import read_table, resolve_output_path, write_table
+from src.sentiment_cube import KEY_BYTES, row_keys
+from src.utils import comment_fingerprint
+
+VIDEO = '宣传片ID'
+DAY = '评论时间差'
+BASE_METRICS = ['评论数', '得分总和']
+LONG_COLUMNS = [VIDEO, DAY, '日期', '指标', '数值']
+
+
+def _usable(df, score_column):
+    """可以进入时间序列的评论：评论时间差为-1表示评论时间早于发布时间（见process_comments.add_time_diff），不进入时间序列"""
+    return df[(df[DAY] > 0) & df[score_column].notna()]
+
+
+def timeseries_keys(df, score_column='情感得分', text_column='评论内容'):
+    """
+    已汇总评论的标识：与立方体相同的行标识再加上得分，重新打分后得分变化的评论也会被当作新评论重新汇总
+
+    返回:
+    Series: 与df索引对齐的16位十六进制标识
+    """
+    if df.empty:
+        return pd.Series(dtype=str)
+    keys = row_keys(df, text_column)
+    return (keys + ':' + df[score_column].astype(float).map(float.hex)).map(comment_fingerprint)
+
+
+def daily_aggregate(df, score_column='情感得分'):
+    """
+    把逐条打分结果汇总为每个视频每天的评论数和得分总和
+
+    参数:
+    df: 包含宣传片ID、评论时间差、视频发布时间和得分列的数据
+    score_column: 得分列名
+
+    返回:
+    DataFrame: 列为宣传片ID、评论时间差、视频发布时间、评论数、得分总和
+    """
+    df = _usable(df, score_column)
+    return (df.groupby([VIDEO, DAY])
+              .agg(视频发布时间=('视频发布时间', 'first'), 评论数=(score_column, 'size'), 得分总和=(score_column, 'sum'))
+              .reset_index())
+
+
+def _dense_grid(daily):
+    """补齐每个视频从发布当天（第1天）到最后一条评论之间没有评论的日期，评论数和得分总和记为0"""
+    last_day = daily.groupby(VIDEO)[DAY].max()
+    lengths = last_day.to_numpy()
+    videos = np.repeat(last_day.index.to_numpy(), lengths)
+    # 每个视频的天数序列1..last_day，用全局序号减去该视频起始位置得到
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    days = np.arange(lengths.sum()) - starts + 1
+    grid = pd.MultiIndex.from_arrays([videos, days], names=[VIDEO, DAY])
+
+    dense = daily.set_index([VIDEO, DAY])[BASE_METRICS].reindex(grid, fill_value=0)
+    publish = daily.groupby(VIDEO)['视频发布时间'].first()
+    dense['日期'] = (pd.to_datetime(publish.reindex(videos).to_numpy())
+                   + pd.to_timedelta(days - 1, unit='D')).strftime('%Y-%m-%d')
+    return dense
+
+
+def compute_series(daily, windows=(7, 30), halflife=7):
+    """
+    计算每个视频的逐日指标
+
+    参数:
+    daily: daily_aggregate的结果
+    windows: 滚动窗口天数
+    halflife: 衰减曲线的半衰期（天）
+
+    返回:
+    DataFrame: 以(宣传片ID, 评论时间差)为索引的宽表，每列一个指标
+    """
+    dense = _dense_grid(daily)
+    by_video = dense.groupby(level=VIDEO)
+    count = dense['评论数'].astype(float)
+    total = dense['得分总和'].astype(float)
+
+    result = dense[['日期']].copy()
+    result['评论数'] = dense['评论数']
+    result['得分总和'] = total
+    result['日均得分'] = total / count.where(count > 0)
+
+    cum_count = by_video['评论数'].cumsum()
+    cum_total = by_video['得分总和'].cumsum()
+    result['累计评论数'] = cum_count
+    result['累计评论占比'] = cum_count / by_video['评论数'].transform('sum')
+    result['累计平均得分'] = cum_total / cum_count.where(cum_count > 0)
+
+    # 滚动窗口和 = 累计和 - w天前的累计和，按评论数加权得到窗口内的平均得分
+    for window in windows:
+        window_count = cum_count - cum_count.groupby(level=VIDEO).shift(window, fill_value=0)
+        window_total = cum_total - cum_total.groupby(level=VIDEO).shift(window, fill_value=0)
+        result[f'滚动{window}日评论数'] = window_count
+        result[f'滚动{window}日平均得分'] = window_total / window_count.where(window_count > 0)
+
+    # 衰减曲线：评论数和得分总和的指数加权平均，两者之比为越近的评论权重越大的平均得分
+    decayed_count = count.groupby(level=VIDEO).ewm(halflife=halflife, adjust=False).mean().droplevel(0)
+    decayed_total = total.groupby(level=VIDEO).ewm(halflife=halflife, adjust=False).mean().droplevel(0)
+    result['衰减平滑评论数'] = decayed_count
+    result['衰减加权得分'] = decayed_total / decayed_count.where(decayed_count > 0)
+    return result
+
+
+def to_long(series):
+    """宽表转为长表（宣传片ID、评论时间差、日期、指标、数值），去掉没有取值的指标"""
+    long = series.reset_index().melt(id_vars=[VIDEO, DAY, '日期'], var_name='指标', value_name='数值')
+    return long.dropna(subset=['数值']).sort_values([VIDEO, DAY], kind='stable').reset_index(drop=True)
+
+
+def _previous_daily(long):
+    """从已有的长表中取回每个视频每天的评论数和得分总和"""
+    base = long[long['指标'].isin(BASE_METRICS)]
+    daily = base.pivot_table(index=[VIDEO, DAY], columns='指标', values='数值', aggfunc='first').reset_index()
+    first_day = long[long[DAY] == 1].drop_duplicates(VIDEO).set_index(VIDEO)['日期']
+    daily['视频发布时间'] = daily[VIDEO].map(first_day)
+    daily = daily[daily['评论数'] > 0]
+    daily[[VIDEO, DAY, '评论数']] = daily[[VIDEO, DAY, '评论数']].astype(int)
+    return daily[[VIDEO, DAY, '视频发布时间'] + BASE_METRICS]
+
+
+def _read_keys(keys_file):
+    if not os.path.exists(keys_file):
+        return set()
+    return {key.decode('ascii') for key in np.fromfile(keys_file, dtype=f'S{KEY_BYTES}').tolist()}
+
+
+def _write_keys(keys_file, keys):
+    """整体替换已汇总评论的标识文件"""
+    os.makedirs(os.path.dirname(os.path.abspath(keys_file)), exist_ok=True)
+    np.array(sorted(keys), dtype=f'S{KEY_BYTES}').tofile(keys_file + '.tmp')
+    os.replace(keys_file + '.tmp', keys_file)
+
+
+def build_sentiment_timeseries(sentiment_file, output_file, output_config=None, windows=(7, 30), halflife=7,
+                               incremental=True, score_column='情感得分',
+                               keys_file='./.cache/sentiment_timeseries_keys.bin'):
+    """
+    生成每个视频的逐日情感时间序列
+
+    参数:
+    sentiment_file: 情感分析结果文件
+    output_file: 时间序列输出路径（长表）
+    output_config: config.yaml中的output配置（可选）
+    windows: 滚动窗口天数
+    halflife: 衰减曲线的半衰期（天）
+    incremental: 为True且已有输出时，找出尚未汇总过的评论（包括已有日期上后来补采的评论），
+                 对涉及的视频从这些评论中最早的一天起重新汇总，更早的日期沿用已有结果；
+                 已汇总过的评论被删除或重新打分时全量重建
+    score_column: 得分列名
+    keys_file: 已汇总评论的标识文件
+
+    返回:
+    DataFrame: 长表格式的时间序列，没有可用的评论时间差时为空表，出错时返回None
+    """
+    try:
+        output_file = resolve_output_path(output_file, 'sentiment_timeseries', output_config)
+        df = _usable(read_table(sentiment_file), score_column)
+        keys = timeseries_keys(df, score_column)
+
+        previous = None
+        stored = _read_keys(keys_file) if incremental and os.path.exists(output_file) else set()
+        if stored and not stored <= set(keys):
+            # 已汇总的评论从结果中删除或得分变化（重新打分）后，已有的逐日汇总里仍包含旧数据，只能全量重建
+            print(f"{len(stored - set(keys))} 条已汇总的评论已删除或重新打分，全量重建时间序列")
+        elif stored:
+            unseen = ~keys.isin(stored)
+            first_affected = df.loc[unseen].groupby(VIDEO)[DAY].min()
+            previous = _previous_daily(read_table(output_file))
+            # 受影响的视频：已有结果中从最早受影响的一天起的日期丢弃，用全部评论重新汇总
+            previous = previous[~(previous[DAY] >= previous[VIDEO].map(first_affected))]
+            df = df[df[DAY] >= df[VIDEO].map(first_affected)]
+            print(f"{int(unseen.sum())} 条新评论涉及 {len(first_affected)} 个视频，从各视频最早受影响的日期起重新汇总")
+
+        daily = daily_aggregate(df, score_column)
+        if previous is not None and not previous.empty:
+            daily = pd.concat([previous, daily], ignore_index=True) if len(daily) else previous
+        if daily.empty:
+            # 评论时间差全部缺失（例如原始文件名中没有宣传片信息）时跳过，不视为出错
+            print("没有可用于时间序列的评论（评论时间差为空），跳过时间序列")
+            long = pd.DataFrame(columns=LONG_COLUMNS)
+        else:
+            long = to_long(compute_series(daily, windows, halflife))
+        write_table(long, output_file, 'sentiment_timeseries', output_config)
+        _write_keys(keys_file, set(keys))
+        print(f"时间序列已保存至: {output_file}（{daily[VIDEO].nunique()} 个视频，{len(long)} 行）")
+        return long
+    except Exception as e:
+        print(f"生成情感时间序列时出错: {str(e)}")
+        return None
+
+
+if __name__ == "__main__":
+    # 使用示例
+    result = build_sentiment_timeseries("情感分析结果.xlsx", "情感时间序列.xlsx")
+    if result is not None:
+        print(result[result['指标'] == '滚动7日平均得分'].head(20))
@@ -0,0 +1,134 @@
+"""
+文件功能：分片打分与确定性合并。按评论指纹或宣传片ID的稳定哈希把输入划分为N个分片，每个分片可以在不同机器上
+        独立打分并写出分片结果文件；合并时按原始顺序重新拼接，并校验所有行都恰好出现一次
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.checkpoint import FINGERPRINT_COLUMN, ROW_COLUMN
+from src.output_writer import read_table
+from src.utils import comment_fingerprint
+
+SHARD_KEYS = ('fingerprint', 'video')
+
+
+def parse_shard(spec):
+    """
+    解析分片参数
+
+    参数:
+    spec: 形如 "2/4" 的字符串，表示共4个分片中的第2个（从1开始编号）
+
+    返回:
+    tuple: (分片编号, 分片总数)
+    """
+    try:
+        index, count = (int(part) for part in str(spec).split('/'))
+    except ValueError:
+        raise ValueError(f"分片参数格式应为 i/N，例如 1/4，当前为 '{spec}'")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"分片编号必须在1到{count}之间，当前为 '{spec}'")
+    return index, count
+
+
+def _stable_hash(value):
+    """与进程、机器无关的稳定哈希（Python内置hash会随进程随机化，不能用于分片）"""
+    return int(hashlib.md5(str(value).encode('utf-8')).hexdigest()[:12], 16)
+
+
+def assign_shards(df, text_column, count, shard_key='fingerprint'):
+    """
+    计算每一行所属的分片（从1开始编号）
+
+    参数:
+    df: 输入数据
+    text_column: 评论内容列名
+    count: 分片总数
+    shard_key: 'fingerprint' 按评论指纹划分（各分片行数均匀）；'video' 按宣传片ID划分（同一视频的评论在同一分片）
+
+    返回:
+    np.ndarray: 每一行的分片编号
+    """
+    if shard_key == 'fingerprint':
+        keys = df[text_column].map(comment_fingerprint)
+    elif shard_key == 'video':
+        keys = df['宣传片ID'].astype(str)
+    else:
+        raise ValueError(f"shard_key只能为 {' 或 '.join(SHARD_KEYS)}，当前为 '{shard_key}'")
+    return np.fromiter((_stable_hash(key) % count + 1 for key in keys), dtype=np.int64, count=len(df))
+
+
+def select_shard(df, text_column, shard, shard_key='fingerprint'):
+    """
+    取出属于指定分片的行，并增加行号和评论指纹列用于合并时校验
+
+    参数:
+    df: 输入数据，索引为原始行号
+    text_column: 评论内容列名
+    shard: (分片编号, 分片总数)
+    shard_key: 分片依据，见assign_shards
+
+    返回:
+    DataFrame: 分片数据（保留原始索引）
+    """
+    index, count = shard
+    shard_df = df[assign_shards(df, text_column, count, shard_key) == index].copy()
+    shard_df.insert(0, FINGERPRINT_COLUMN, shard_df[text_column].map(comment_fingerprint))
+    shard_df.insert(0, ROW_COLUMN, shard_df.index)
+    print(f"分片 {index}/{count}：{len(shard_df)}/{len(df)} 行")
+    return shard_df
+
+
+def shard_path(path, shard):
+    """分片结果文件路径，例如 情感分析结果.xlsx -> 情感分析结果.shard-2-of-4.xlsx"""
+    index, count = shard
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.shard-{index}-of-{count}{ext}"
+
+
+def merge_shards(path, count, expected, text_column='评论内容'):
+    """
+    合并全部分片结果，按原始顺序排列并校验完整性
+
+    参数:
+    path: 合并后的输出路径（各分片文件由shard_path推出）
+    count: 分片总数
+    expected: 期望的行，Series，索引为行号、值为评论内容，顺序即合并后的顺序
+    text_column: 评论内容列名
+
+    返回:
+    DataFrame: 合并后的结果（已去掉行号和评论指纹列）
+
+    异常:
+    ValueError: 分片文件缺失、行重复、行缺失、多出行或评论指纹与输入不一致时抛出
+    """
+    shard_files = [shard_path(path, (index, count)) for index in range(1, count + 1)]
+    missing_files = [file for file in shard_files if not os.path.exists(file)]
+    if missing_files:
+        raise ValueError(f"缺少 {len(missing_files)} 个分片结果：{', '.join(missing_files)}")
+
+    frames = [read_table(file, dtype={FINGERPRINT_COLUMN: str}) for file in shard_files]
+    # 按宣传片ID分片时可能有分片没有任何行，空分片不参与拼接，避免其空列影响合并后的列类型
+    merged = pd.concat([frame for frame in frames if len(frame)] or frames[:1], ignore_index=True)
+    rows = merged[ROW_COLUMN]
+    problems = []
+    if rows.duplicated().any():
+        problems.append(f"{rows.duplicated().sum()} 行在多个分片中重复出现")
+    if (~expected.index.isin(rows)).any():
+        problems.append(f"{(~expected.index.isin(rows)).sum()} 行没有出现在任何分片中")
+    if (~rows.isin(expected.index)).any():
+        problems.append(f"{(~rows.isin(expected.index)).sum()} 行不属于当前输入")
+    if not problems:
+        merged = merged.set_index(ROW_COLUMN).loc[expected.index]
+        mismatched = merged[FINGERPRINT_COLUMN].values != expected.map(comment_fingerprint).values
+        if mismatched.any():
+            problems.append(f"{mismatched.sum()} 行的评论指纹与当前输入不一致（输入文件在分片打分后发生了变化）")
+    if problems:
+        raise ValueError("分片结果校验失败：" + "；".join(problems))
+
+    print(f"已合并 {count} 个分片，共 {len(merged)} 行")
+    return merged.drop(columns=[FINGERPRINT_COLUMN]).reset_index(drop=True)
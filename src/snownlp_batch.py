@@ -0,0 +1,166 @@
+"""
+文件功能：与SnowNLP兼容的批量情感打分。一次性把SnowNLP训练好的朴素贝叶斯模型转换为词表索引上的
+        NumPy对数概率矩阵，分词后用稀疏累加（按文档bincount）一次算出整批评论的得分，
+        结果与 SnowNLP(text).sentiments 一致
+"""
+
+from functools import lru_cache
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from src.checkpoint import report_error
+
+
+@lru_cache(maxsize=200000)
+def _segment_run(run):
+    """对一段连续汉字分词，评论中大量重复的片段（如“哈哈哈”）只分词一次"""
+    from snownlp import seg
+
+    return tuple(seg.single_seg(run))
+
+
+def clear_segment_cache():
+    """清空进程内的分词缓存，测量冷启动打分速度前调用"""
+    _segment_run.cache_clear()
+
+
+def segment_text(text):
+    """
+    与 snownlp.sentiment.Sentiment.handle 等价的分词：按连续汉字切分后分词，其余部分按空白切分，
+    最后去除停用词
+    """
+    from snownlp import normal, seg
+
+    words = []
+    for part in seg.re_zh.split(text):
+        part = part.strip()
+        if not part:
+            continue
+        if seg.re_zh.match(part):
+            words += _segment_run(part)
+        else:
+            words += [word.strip() for word in part.split() if word.strip()]
+    return normal.filter_stop(words)
+
+
+def _segment_or_error(text):
+    """多进程分词的工作函数：出错时返回错误信息而不是抛出，单条文本出错不影响同一批的其他文本"""
+    try:
+        return segment_text(text), None
+    except Exception as e:
+        return [], e
+
+
+class BatchSentimentScorer:
+    """SnowNLP情感模型的向量化版本"""
+
+    def __init__(self, classifier=None):
+        """
+        参数:
+        classifier: snownlp.sentiment.Sentiment实例（可选），默认使用SnowNLP自带的已训练模型
+        """
+        if classifier is None:
+            from snownlp import sentiment
+            classifier = sentiment.classifier
+        bayes = classifier.classifier
+
+        self.labels = list(bayes.d.keys())
+        self.vocab = {}
+        for prob in bayes.d.values():
+            for word in prob.d:
+                self.vocab.setdefault(word, len(self.vocab))
+        oov = len(self.vocab)  # 最后一行对应未登录词
+
+        # log_freq[词, 类别] = log(该类别下的词频/该类别总数)，未登录词使用加一平滑的默认计数
+        self.log_freq = np.empty((oov + 1, len(self.labels)))
+        self.log_prior = np.empty(len(self.labels))
+        for j, label in enumerate(self.labels):
+            prob = bayes.d[label]
+            counts = np.full(oov + 1, float(prob.none))
+            counts[[self.vocab[word] for word in prob.d]] = list(prob.d.values())
+            self.log_freq[:, j] = np.log(counts / prob.getsum())
+            self.log_prior[j] = np.log(prob.getsum()) - np.log(bayes.total)
+        self.pos_index = self.labels.index('pos')
+
+    def score_words(self, word_lists):
+        """
+        对已分词的文档批量打分
+
+        参数:
+        word_lists: 每个文档一个词列表（已去除停用词）
+
+        返回:
+        np.ndarray: 每个文档的正面概率
+        """
+        oov = len(self.vocab)
+        lengths = np.fromiter((len(words) for words in word_lists), dtype=np.int64, count=len(word_lists))
+        token_ids = np.fromiter(
+            (self.vocab.get(word, oov) for words in word_lists for word in words),
+            dtype=np.int64, count=int(lengths.sum())
+        )
+        doc_index = np.repeat(np.arange(len(word_lists)), lengths)
+
+        # 等价于 (文档×词 的CSR计数矩阵) @ log_freq，按文档累加每个词的对数概率
+        log_post = np.tile(self.log_prior, (len(word_lists), 1))
+        for j in range(len(self.labels)):
+            log_post[:, j] += np.bincount(doc_index, weights=self.log_freq[token_ids, j],
+                                          minlength=len(word_lists))
+
+        # 数值稳定的softmax，取正面类别的概率
+        log_post -= log_post.max(axis=1, keepdims=True)
+        post = np.exp(log_post)
+        return post[:, self.pos_index] / post.sum(axis=1)
+
+    def score(self, texts, processes=1, error_log=None, rows=None):
+        """
+        对原始文本批量打分，相同文本只分词一次
+
+        参数:
+        texts: 文本序列
+        processes: 分词使用的进程数。子进程各自加载分词模型、从空缓存开始分词，分词结果还要传回主进程，
+                   实测1500条评论时2个进程只快约1.2倍（5.2秒对6.4秒），默认单进程即可
+        error_log: 错误日志（可选），分词出错的文本写入日志而不是打印
+        rows: 每条文本在输入文件中的行号，写入错误日志（可选，texts为Series时默认使用其索引）
+
+        返回:
+        np.ndarray: 每条文本的正面概率，空值、空字符串（SnowNLP对空字符串会抛出异常）或出错的文本为NaN
+        """
+        if rows is None and isinstance(texts, pd.Series):
+            rows = texts.index
+        texts = [None if pd.isna(text) or str(text) == '' else str(text) for text in texts]
+        unique = {}
+        text_rows = {}
+        for i, text in enumerate(texts):
+            if text is not None:
+                unique.setdefault(text, len(unique))
+                if rows is not None:
+                    text_rows.setdefault(text, []).append(rows[i])
+
+        if processes > 1 and len(unique) > processes:
+            with Pool(processes) as pool:
+                results = pool.map(_segment_or_error, list(unique), chunksize=256)
+        else:
+            results = [_segment_or_error(text) for text in unique]
+
+        word_lists = []
+        failed = np.zeros(len(unique), dtype=bool)
+        for i, (text, (words, error)) in enumerate(zip(unique, results)):
+            word_lists.append(words)
+            if error is not None:
+                # 相同文本只分词一次，出错时记录它所在的全部行
+                text_row = text_rows.get(text)
+                report_error(error_log, 'SnowNLP', text, error,
+                             text_row[0] if text_row and len(text_row) == 1 else text_row)
+                failed[i] = True
+
+        unique_scores = self.score_words(word_lists) if word_lists else np.empty(0)
+        unique_scores[failed] = np.nan
+        return np.array([np.nan if text is None else unique_scores[unique[text]] for text in texts])
+
+
+@lru_cache(maxsize=1)
+def get_batch_scorer():
+    """加载一次SnowNLP模型并在进程内复用"""
+    return BatchSentimentScorer()
@@ -0,0 +1,113 @@
+"""
+文件功能：平台表情（如[赞R]、[笑哭R]）的一次性解析。每条评论只按表情正则切分一次，得到表情词表和CSR格式的
+        稀疏索引（每条评论的表情编号存放在 offsets[i]:offsets[i+1] 区间内），评论字数和表情情感得分
+        都从这个索引计算，不再由各个步骤分别重新扫描原文
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+STICKER_PATTERN = re.compile(r'(\[[^\]]+\])')  # 表情格式为[xxx]或[xxxR]，带分组以便split时保留表情
+NON_WORD_PATTERN = re.compile(r'[^\w\s]')  # 去除表情后只保留文字和空格
+
+
+def split_stickers(text):
+    """
+    把文本切分为文字片段和表情
+
+    返回:
+    tuple: (文字片段列表, 表情列表)，文字片段比表情多一个，原文为两者交错拼接
+    """
+    pieces = STICKER_PATTERN.split(text)
+    return pieces[::2], pieces[1::2]
+
+
+def sticker_name(sticker):
+    """表情名称：去掉方括号和小红书表情末尾的R，例如 [笑哭R] -> 笑哭"""
+    name = sticker[1:-1]
+    return name[:-1] if len(name) > 1 and name.endswith('R') else name
+
+
+class StickerIndex:
+    """一批评论的表情稀疏索引，以及由同一次切分得到的评论字数"""
+
+    def __init__(self, texts):
+        """
+        参数:
+        texts: 评论文本序列（空值按 str(text) 计算字数，与原来的add_comment_length一致）
+        """
+        self.vocab = {}
+        token_ids = []
+        offsets = [0]
+        lengths = []
+        lengths_with_stickers = []
+
+        for text in texts:
+            segments, stickers = split_stickers(str(text))
+            token_ids.extend(self.vocab.setdefault(sticker, len(self.vocab)) for sticker in stickers)
+            offsets.append(len(token_ids))
+
+            # 去除表情后再去掉标点；表情计为1个字符时用'a'连接各文字片段，等价于把表情替换为'a'
+            cleaned_segments = [NON_WORD_PATTERN.sub('', segment) for segment in segments]
+            lengths.append(len(''.join(cleaned_segments).strip()))
+            lengths_with_stickers.append(len('a'.join(cleaned_segments).strip()))
+
+        self.token_ids = np.asarray(token_ids, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.lengths_with_stickers = np.asarray(lengths_with_stickers, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def stickers(self):
+        """表情词表，按编号排列"""
+        return list(self.vocab)
+
+    @property
+    def sticker_counts(self):
+        """每条评论的表情数"""
+        return np.diff(self.offsets)
+
+    def comment_stickers(self, i):
+        """第i条评论中的表情（按出现顺序）"""
+        stickers = self.stickers
+        return [stickers[j] for j in self.token_ids[self.offsets[i]:self.offsets[i + 1]]]
+
+    def vocab_frequency(self):
+        """
+        每个表情出现的总次数
+
+        返回:
+        Series: 索引为表情，按次数降序
+        """
+        counts = np.bincount(self.token_ids, minlength=len(self.vocab))
+        return pd.Series(counts, index=self.stickers, name='出现次数').sort_values(ascending=False)
+
+    def polarity(self, scorer=None):
+        """
+        表情情感得分：每个表情名称只打分一次，评论得分为其中各表情得分的平均
+
+        参数:
+        scorer: 接收文本列表、返回得分数组的函数，默认使用SnowNLP批量打分
+
+        返回:
+        np.ndarray: 每条评论的表情情感得分，没有表情的评论为NaN
+        """
+        if scorer is None:
+            from src.snownlp_batch import get_batch_scorer
+            scorer = get_batch_scorer().score
+        vocab_scores = np.asarray(scorer([sticker_name(sticker) for sticker in self.stickers]), dtype=float)
+        if len(vocab_scores) == 0:
+            return np.full(len(self), np.nan)
+
+        token_scores = vocab_scores[self.token_ids]
+        valid = ~np.isnan(token_scores)
+        doc_index = np.repeat(np.arange(len(self)), self.sticker_counts)
+        totals = np.bincount(doc_index[valid], weights=token_scores[valid], minlength=len(self))
+        counts = np.bincount(doc_index[valid], minlength=len(self))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, totals / counts, np.nan)
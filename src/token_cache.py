@@ -0,0 +1,188 @@
+"""
+文件功能：Transformer模型的分词结果缓存。按(分词器, 预处理后文本)缓存input_ids，以追加方式写入磁盘，
+        读取时通过np.memmap零拷贝映射，同一语料重复实验时可以完全跳过分词
+"""
+
+import hashlib
+import os
+import re
+
+import numpy as np
+
+from src.utils import file_lock
+
+
+class TokenCache:
+    """
+    单个分词器的分词缓存，每个分词器使用缓存目录下的一个子目录，包含三个追加写入的文件:
+        - ids.bin: 所有文本的input_ids首尾相接（int32）
+        - lengths.bin: 每条文本的token数（int32）
+        - keys.bin: 每条文本的20字节sha1摘要，最后写入，作为一条记录写入完成的标志
+    追加写入和截断都在目录下.lock文件的排他锁内进行，多个进程（并行的步骤、共享存储上的分片）可以共用一个缓存
+    attention_mask不单独存储：未填充的序列全部为1，组成批次时根据长度生成
+    """
+
+    def __init__(self, cache_dir, tokenizer, max_length=512, preprocess=None):
+        """
+        参数:
+        cache_dir: 缓存根目录
+        tokenizer: transformers分词器
+        max_length: 截断长度，不同截断长度使用不同的缓存
+        preprocess: 文本预处理函数，缓存键基于预处理后的文本
+        """
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.preprocess = preprocess or (lambda text: str(text))
+        name = getattr(tokenizer, 'name_or_path', None) or type(tokenizer).__name__
+        self.cache_path = os.path.join(cache_dir, re.sub(r'[^\w.-]', '_', f"{name}_{max_length}"))
+        os.makedirs(self.cache_path, exist_ok=True)
+        self.index = {}
+        with file_lock(self._file('.lock')):
+            self._load()
+
+    def _file(self, name):
+        return os.path.join(self.cache_path, name)
+
+    def _memmap(self, name, dtype, count):
+        """映射文件的前count个元素，空文件返回空数组"""
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode='r', shape=(count,))
+
+    def _load(self):
+        """
+        映射磁盘上的缓存文件，并截掉上次中断时写了一半的记录；必须在持有锁时调用，
+        否则会截掉其他进程正在写入、尚未写完keys的记录
+        """
+        def count(name, dtype):
+            path = self._file(name)
+            return os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+
+        n = min(count('keys.bin', 'S20'), count('lengths.bin', np.int32))
+        lengths = np.fromfile(self._file('lengths.bin'), dtype=np.int32, count=n) if n else np.empty(0, np.int32)
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        if count('ids.bin', np.int32) < offsets[-1]:
+            # ids不完整时回退到ids能覆盖的最后一条记录
+            n = int(np.searchsorted(offsets, count('ids.bin', np.int32), side='right')) - 1
+            offsets = offsets[:n + 1]
+
+        # 截断前不能持有映射（Windows下被映射的文件无法截断）
+        for name, size in (('keys.bin', n * 20), ('lengths.bin', n * 4), ('ids.bin', int(offsets[-1]) * 4)):
+            path = self._file(name)
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                os.truncate(path, size)
+
+        self.keys = self._memmap('keys.bin', 'S20', n)
+        self.lengths = self._memmap('lengths.bin', np.int32, n)
+        self.offsets = offsets
+        self.ids = self._memmap('ids.bin', np.int32, int(offsets[-1]))
+        # 只为新增的记录建立索引；numpy的定长字节串会去掉末尾的\x00，摘要以\x00结尾时需要补齐长度才能与新计算的摘要匹配
+        start = len(self.index) if len(self.index) <= n else 0
+        if start == 0:
+            self.index = {}
+        self.index.update((key.ljust(20, b'\x00'), row)
+                          for row, key in enumerate(self.keys[start:].tolist(), start=start))
+
+    def __len__(self):
+        return len(self.index)
+
+    def encode(self, texts):
+        """
+        返回每条文本在缓存中的行号，未缓存的文本会分词后追加写入
+
+        参数:
+        texts: 原始文本列表
+
+        返回:
+        np.ndarray: 与texts一一对应的缓存行号
+        """
+        normalized = [self.preprocess(text) for text in texts]
+        keys = [hashlib.sha1(text.encode('utf-8')).digest() for text in normalized]
+
+        missing = {}
+        for key, text in zip(keys, normalized):
+            if key not in self.index and key not in missing:
+                missing[key] = text
+        if missing:
+            self._append(list(missing.keys()), list(missing.values()))
+
+        return np.array([self.index[key] for key in keys], dtype=np.int64)
+
+    def _append(self, keys, texts):
+        """分词并在锁内追加写入，按ids、lengths、keys的顺序写入保证中断后可恢复"""
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length)['input_ids']
+        with file_lock(self._file('.lock')):
+            self.keys = self.lengths = self.ids = None  # 释放旧的映射后再写入
+            # 先读入其他进程在此期间追加的记录，已被写入的文本不再重复写入
+            self._load()
+            todo = [i for i, key in enumerate(keys) if key not in self.index]
+            if todo:
+                self.keys = self.lengths = self.ids = None
+                with open(self._file('ids.bin'), 'ab') as f:
+                    np.concatenate([np.asarray(encoded[i], dtype=np.int32) for i in todo]).tofile(f)
+                with open(self._file('lengths.bin'), 'ab') as f:
+                    np.array([len(encoded[i]) for i in todo], dtype=np.int32).tofile(f)
+                with open(self._file('keys.bin'), 'ab') as f:
+                    np.array([keys[i] for i in todo], dtype='S20').tofile(f)
+                self._load()
+
+    def get(self, row):
+        """返回缓存中第row条文本的input_ids（memmap视图，不复制数据）"""
+        return self.ids[self.offsets[row]:self.offsets[row + 1]]
+
+    def make_batch(self, rows):
+        """
+        把若干缓存行组成右侧填充的批次
+
+        返回:
+        tuple: (input_ids, attention_mask)，均为int64的二维数组
+        """
+        lengths = self.lengths[rows]
+        width = int(lengths.max()) if len(rows) else 0
+        pad_id = self.tokenizer.pad_token_id or 0
+        input_ids = np.full((len(rows), width), pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(rows), width), dtype=np.int64)
+        for i, row in enumerate(rows):
+            input_ids[i, :lengths[i]] = self.get(row)
+            attention_mask[i, :lengths[i]] = 1
+        return input_ids, attention_mask
+
+    def iter_batches(self, texts, batch_size=32):
+        """
+        按token长度排序后分批，减少填充
+
+        返回:
+        迭代器，每次产出 (positions, input_ids, attention_mask)，positions为批内各条在texts中的位置
+        """
+        rows = self.encode(texts)
+        order = np.argsort(self.lengths[rows], kind='stable')
+        for start in range(0, len(order), batch_size):
+            positions = order[start:start + batch_size]
+            input_ids, attention_mask = self.make_batch(rows[positions])
+            yield positions, input_ids, attention_mask
+
+    def length_stats(self, texts=None, bucket_count=4):
+        """
+        统计token长度分布，并按分位数给出长度分桶边界，用于选择批次大小
+
+        参数:
+        texts: 只统计这些文本（可选），默认统计缓存中的全部文本
+        bucket_count: 分桶数量
+
+        返回:
+        dict: 数量、平均值、最大值、各分位数和分桶边界
+        """
+        lengths = self.lengths[self.encode(texts)] if texts is not None else np.asarray(self.lengths)
+        if len(lengths) == 0:
+            return {'count': 0}
+        quantiles = np.linspace(0, 1, bucket_count + 1)[1:]
+        return {
+            'count': int(len(lengths)),
+            'mean': float(lengths.mean()),
+            'max': int(lengths.max()),
+            'p50': float(np.percentile(lengths, 50)),
+            'p90': float(np.percentile(lengths, 90)),
+            'p99': float(np.percentile(lengths, 99)),
+            'buckets': sorted({int(np.ceil(np.quantile(lengths, q))) for q in quantiles}),
+        }
@@ -2,10 +2,16 @@
 工具函数模块：提供文本预处理、表情符号处理和格式化打印等通用功能
 """
 
+import hashlib
+import os
 import re
+from contextlib import contextmanager
+
 import emoji
 import pandas as pd
 
+from src.sticker_index import NON_WORD_PATTERN, STICKER_PATTERN
+
 def preprocess_text(text):
     """预处理文本内容"""
     if pd.isna(text):
@@ -24,11 +30,49 @@ def clean_emoji(text):
     """清理文本中的表情符号"""
     if pd.isna(text):
         return ""
-    clean_text = re.sub(r'\[[^\]]+\]', '', str(text))
-    clean_text = re.sub(r'[^\w\s]', '', clean_text)
+    clean_text = STICKER_PATTERN.sub('', str(text))
+    clean_text = NON_WORD_PATTERN.sub('', clean_text)
     return clean_text.strip()
 
 
+def comment_fingerprint(text):
+    """计算评论指纹：评论内容去除首尾空白后的sha1前16位，用于在不同步骤、不同文件间稳定地标识同一条评论"""
+    text = "" if pd.isna(text) else str(text).strip()
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+@contextmanager
+def file_lock(path):
+    """
+    跨进程的排他文件锁（POSIX使用fcntl.flock，Windows使用msvcrt.locking），用于多个进程追加写入同一组缓存文件
+
+    参数:
+    path: 锁文件路径，不存在时自动创建
+    """
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # 约10秒内未取得锁时抛出OSError，继续等待
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
 def format_print(message, is_title=False):
     """格式化打印信息"""
     if is_title:
@@ -0,0 +1,103 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.checkpoint import ErrorLog, ResultCheckpoint, report_error, score_with_checkpoint
+
+
+def score(texts):
+    return pd.DataFrame({'长度': texts.str.len(), '正面': texts.str.contains('好').astype(float)})
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(chunks):
+    calls = []
+
+    def score_func(texts):
+        if len(calls) == chunks:
+            raise Interrupted()
+        calls.append(len(texts))
+        return score(texts)
+    return score_func
+
+
+@pytest.fixture
+def texts():
+    return pd.Series([f'评论{i}' + ('好' * (i % 3)) for i in range(23)], index=range(100, 123))
+
+
+def test_resume_reproduces_full_run(tmp_path, texts):
+    full = score_with_checkpoint(texts, score, ResultCheckpoint(str(tmp_path / 'full.csv')), every=5)
+
+    path = str(tmp_path / 'resumed.csv')
+    with pytest.raises(Interrupted):
+        score_with_checkpoint(texts, interrupt_after(2), ResultCheckpoint(path), every=5)
+    calls = []
+
+    def counting(chunk):
+        calls.append(len(chunk))
+        return score(chunk)
+    resumed = score_with_checkpoint(texts, counting, ResultCheckpoint(path, resume=True), every=5)
+
+    assert sum(calls) == len(texts) - 10
+    pd.testing.assert_frame_equal(resumed, full)
+
+
+def test_partial_last_line_is_rescored(tmp_path, texts):
+    path = tmp_path / 'partial.csv'
+    with pytest.raises(Interrupted):
+        score_with_checkpoint(texts, interrupt_after(1), ResultCheckpoint(str(path)), every=5)
+    with open(path, 'ab') as f:
+        f.write('105,半行'.encode('utf-8'))
+
+    resumed = score_with_checkpoint(texts, score, ResultCheckpoint(str(path), resume=True), every=5)
+    full = score_with_checkpoint(texts, score, ResultCheckpoint(str(tmp_path / 'full.csv')), every=5)
+    pd.testing.assert_frame_equal(resumed, full)
+
+
+def test_changed_input_rows_are_rescored(tmp_path, texts):
+    path = str(tmp_path / 'changed.csv')
+    score_with_checkpoint(texts, score, ResultCheckpoint(path), every=5)
+    changed = texts.copy()
+    changed.loc[103] = '完全不同的好评论'
+
+    calls = []
+
+    def counting(chunk):
+        calls.append(list(chunk.index))
+        return score(chunk)
+    resumed = score_with_checkpoint(changed, counting, ResultCheckpoint(path, resume=True), every=5)
+
+    assert calls == [[103]]
+    pd.testing.assert_frame_equal(resumed, score(changed).astype(resumed.dtypes.to_dict()), check_names=False)
+
+
+def test_resume_with_different_scoring_mode_is_refused(tmp_path, texts):
+    path = str(tmp_path / 'sentiment.csv')
+    with pytest.raises(Interrupted):
+        score_with_checkpoint(texts, interrupt_after(1), ResultCheckpoint(path, signature={'scoring_mode': 'snownlp'}),
+                              every=5)
+
+    with pytest.raises(ValueError):
+        ResultCheckpoint(path, resume=True, signature={'scoring_mode': 'cascade'})
+    resumed = score_with_checkpoint(texts, score, ResultCheckpoint(path, True, {'scoring_mode': 'snownlp'}), every=5)
+    assert len(resumed) == len(texts)
+    # 不续跑时清空旧检查点，可以换用新的打分方式
+    ResultCheckpoint(path, signature={'scoring_mode': 'cascade'})
+    assert not os.path.exists(path)
+
+
+def test_error_log_records_rows(tmp_path):
+    path = tmp_path / 'errors.jsonl'
+    log = ErrorLog(str(path))
+    report_error(log, 'SnowNLP', '坏文本', RuntimeError('分词失败'), np.int64(7))
+    report_error(log, 'SnowNLP', '重复文本', RuntimeError('分词失败'), [np.int64(3), np.int64(9)])
+    entries = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert [entry['row'] for entry in entries] == [7, [3, 9]]
+    assert log.count == 2
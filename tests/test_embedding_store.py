@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.embedding_store import EmbeddingStore
+
+DIM = 8
+
+
+def random_vectors(n, seed):
+    return np.random.default_rng(seed).normal(size=(n, DIM)).astype(np.float32)
+
+
+def open_store(path, **kwargs):
+    return EmbeddingStore(str(path), dim=DIM, dtype='float32', model_name='bert:mean', **kwargs)
+
+
+def test_append_skips_stored_and_repeated_fingerprints(tmp_path):
+    store = open_store(tmp_path)
+    vectors = random_vectors(4, 0)
+    assert store.append(['a', 'b', 'a', 'c'], vectors) == 3
+    assert store.append(['c', 'd', 'd'], random_vectors(3, 1)) == 1
+
+    reopened = open_store(tmp_path)
+    assert len(reopened) == 4
+    expected = vectors[[0, 1]] / np.linalg.norm(vectors[[0, 1]], axis=1, keepdims=True)
+    np.testing.assert_allclose(reopened.get(['a', 'b']), expected, rtol=1e-6)
+    assert np.isnan(reopened.get(['x'])).all()
+    assert reopened.missing(['a', 'x', 'y', 'x']) == ['x', 'y']
+
+
+def test_incremental_index_matches_reopened_store(tmp_path):
+    store = open_store(tmp_path)
+    for start in range(0, 50, 10):
+        store.append([f'fp{i}' for i in range(start, start + 10)], random_vectors(10, start))
+    assert store.index == open_store(tmp_path).index
+    assert store.index['fp37'] == 37
+
+
+def test_partial_write_is_truncated_on_load(tmp_path):
+    store = open_store(tmp_path)
+    store.append(['a', 'b'], random_vectors(2, 0))
+    # 模拟向量已写入、指纹只写了一半时中断
+    with open(os.path.join(str(tmp_path), 'vectors.bin'), 'ab') as f:
+        random_vectors(1, 1).tofile(f)
+    with open(os.path.join(str(tmp_path), 'keys.bin'), 'ab') as f:
+        f.write(b'0123')
+
+    reopened = open_store(tmp_path)
+    assert len(reopened) == 2
+    assert os.path.getsize(os.path.join(str(tmp_path), 'keys.bin')) == 2 * 16
+    assert os.path.getsize(os.path.join(str(tmp_path), 'vectors.bin')) == 2 * DIM * 4
+    assert reopened.append(['c'], random_vectors(1, 2)) == 1
+    assert open_store(tmp_path).index == {'a': 0, 'b': 1, 'c': 2}
+
+
+def test_model_name_mismatch_is_rejected(tmp_path):
+    open_store(tmp_path)
+    with pytest.raises(ValueError):
+        EmbeddingStore(str(tmp_path), dim=DIM, dtype='float32', model_name='bert:cls')
+    # 不指定模型名称时只读取
+    assert EmbeddingStore(str(tmp_path)).dim == DIM
+
+
+def test_chunked_search_matches_brute_force(tmp_path):
+    store = open_store(tmp_path)
+    vectors = random_vectors(100, 0)
+    fingerprints = [f'fp{i:03d}' for i in range(100)]
+    store.append(fingerprints, vectors)
+    queries = random_vectors(3, 1)
+
+    result = store.search(queries, k=5, chunk_size=7)
+
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ normalized.T
+    for q in range(len(queries)):
+        top = np.argsort(-scores[q])[:5]
+        rows = result[result['查询序号'] == q]
+        assert rows['评论指纹'].tolist() == [fingerprints[i] for i in top]
+        np.testing.assert_allclose(rows['相似度'], scores[q, top], rtol=1e-5)
+        assert rows['排名'].tolist() == [1, 2, 3, 4, 5]
@@ -0,0 +1,25 @@
+import pandas as pd
+import pytest
+
+from src.extract_comments import process_folder
+
+
+@pytest.fixture
+def folder(tmp_path):
+    pd.DataFrame({
+        ' 评论内容 ': ['好看', '想去'], '评论类型': ['主评论', '子评论'],
+        '评论时间': ['2024-01-01', '2024-01-02'], 'IP地址': ['北京', '上海'],
+    }).to_excel(tmp_path / '宣传片A.xlsx', index=False)
+    pd.DataFrame({'评论内容': ['缺列']}).to_excel(tmp_path / '宣传片B.xlsx', index=False)
+    return str(tmp_path)
+
+
+def test_failed_file_fails_extraction_by_default(folder):
+    assert process_folder(folder) is None
+
+
+def test_skip_failed_keeps_valid_files(folder, capsys):
+    df = process_folder(folder, skip_failed=True)
+    assert df['评论内容'].tolist() == ['好看', '想去']
+    assert df['是否主评论'].tolist() == [1, 0]
+    assert '宣传片B.xlsx' in capsys.readouterr().out
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from src.output_writer import _excel_rows, read_table, write_table
+
+SPLIT_BY_FILE = {'split_mode': 'file', 'max_rows_per_sheet': 3}
+
+
+def test_split_files_round_trip(tmp_path):
+    path = str(tmp_path / '结果.xlsx')
+    df = pd.DataFrame({'值': range(10)})
+    written = write_table(df, path, output_config=SPLIT_BY_FILE)
+    assert len(written) == 5
+    pd.testing.assert_frame_equal(read_table(path), df)
+
+
+def test_shrinking_write_removes_stale_parts(tmp_path):
+    path = str(tmp_path / '结果.xlsx')
+    write_table(pd.DataFrame({'值': range(10)}), path, output_config=SPLIT_BY_FILE)
+    smaller = pd.DataFrame({'值': [100, 101, 102]})
+    write_table(smaller, path, output_config=SPLIT_BY_FILE)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['结果.xlsx', '结果_part2.xlsx']
+    pd.testing.assert_frame_equal(read_table(path), smaller)
+
+
+def test_sheet_mode_removes_parts_from_file_mode(tmp_path):
+    path = str(tmp_path / '结果.xlsx')
+    write_table(pd.DataFrame({'值': range(10)}), path, output_config=SPLIT_BY_FILE)
+    df = pd.DataFrame({'值': range(5)})
+    write_table(df, path, output_config={'split_mode': 'sheet', 'max_rows_per_sheet': 3})
+    assert [p.name for p in tmp_path.iterdir()] == ['结果.xlsx']
+    pd.testing.assert_frame_equal(read_table(path), df)
+
+
+def test_escaped_literal_round_trip(tmp_path):
+    path = str(tmp_path / '结果.xlsx')
+    df = pd.DataFrame({'评论内容': ['换行_x000D_字面量', '_x005F_x0041_', '普通评论']})
+    write_table(df, path)
+    pd.testing.assert_frame_equal(read_table(path), df)
+
+
+def test_excel_rows_match_across_chunks():
+    df = pd.DataFrame({
+        '文本': ['a', None, 'c', 'd', 'e'],
+        '数值': [1.5, np.nan, 3.0, 4.0, 5.0],
+        '时间': pd.Series([pd.Timestamp('2024-01-01'), pd.NaT, pd.Timestamp('2024-01-03 08:00'),
+                         pd.Timestamp('2024-01-04'), pd.Timestamp('2024-01-05')]),
+    })
+    rows = list(_excel_rows(df, chunk_size=2))
+    assert rows == list(_excel_rows(df, chunk_size=100))
+    assert rows[1] == (None, None, None)
+    assert rows[2] == ('c', 3.0, '2024-01-03 08:00:00')
+    assert len(rows) == 5
@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from src.pipeline import Pipeline, Stage
+
+
+def copy_stage(name, source, target, calls, fail=False, **kwargs):
+    """把source的内容加上步骤名写入target"""
+    def run(config):
+        calls.append(name)
+        if fail:
+            return False
+        with open(source, encoding='utf-8') as f:
+            text = f.read()
+        with open(target, 'w', encoding='utf-8') as f:
+            f.write(text + name)
+        return True
+    return Stage(name, run, inputs=[source], outputs=[target], **kwargs)
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = {name: str(tmp_path / f'{name}.txt') for name in ('raw', 'a', 'b', 'c', 'model')}
+    with open(paths['raw'], 'w', encoding='utf-8') as f:
+        f.write('原始数据')
+    paths['state'] = str(tmp_path / 'state.json')
+    return paths
+
+
+def make_pipeline(files, calls, config=None, fail=(), watch=()):
+    # a <- raw，b <- a，c <- a；b和c互不依赖
+    stages = [
+        copy_stage('a', files['raw'], files['a'], calls, 'a' in fail, config_keys=['threshold']),
+        copy_stage('b', files['a'], files['b'], calls, 'b' in fail, watch=watch),
+        copy_stage('c', files['a'], files['c'], calls, 'c' in fail),
+    ]
+    return Pipeline(stages, config or {'threshold': 1}, state_file=files['state'])
+
+
+def test_dependencies_are_inferred_from_files(files):
+    pipeline = make_pipeline(files, [])
+    assert pipeline.dependencies('a') == []
+    assert pipeline.dependencies('b') == ['a']
+    assert pipeline.with_upstream(['c']) == ['a', 'c']
+
+
+def test_second_run_is_cached(files):
+    calls = []
+    assert set(make_pipeline(files, calls).run().values()) == {'done'}
+    assert set(make_pipeline(files, calls).run().values()) == {'cached'}
+    assert sorted(calls) == ['a', 'b', 'c']
+
+
+def test_changed_input_reruns_downstream(files):
+    make_pipeline(files, []).run()
+    with open(files['raw'], 'w', encoding='utf-8') as f:
+        f.write('新数据')
+    calls = []
+    status = make_pipeline(files, calls).run()
+    assert status == {'a': 'done', 'b': 'done', 'c': 'done'}
+
+
+def test_changed_config_reruns_stage(files):
+    make_pipeline(files, []).run()
+    calls = []
+    status = make_pipeline(files, calls, config={'threshold': 2}).run()
+    # a的输出内容不变，下游步骤仍然命中缓存
+    assert status == {'a': 'done', 'b': 'cached', 'c': 'cached'}
+
+
+def test_missing_output_reruns_stage(files):
+    make_pipeline(files, []).run()
+    os.remove(files['c'])
+    assert make_pipeline(files, []).run()['c'] == 'done'
+
+
+def test_force_only_reruns_targets(files):
+    make_pipeline(files, []).run()
+    calls = []
+    status = make_pipeline(files, calls).run(['b'], force=True)
+    assert status == {'a': 'cached', 'b': 'done'}
+    assert calls == ['b']
+
+
+def test_failure_skips_downstream(files):
+    calls = []
+    status = make_pipeline(files, calls, fail=('a',)).run()
+    assert status == {'a': 'failed', 'b': 'skipped', 'c': 'skipped'}
+    assert calls == ['a']
+    # 失败的步骤不记录缓存，修复后重新执行
+    assert make_pipeline(files, []).run()['a'] == 'done'
+
+
+def test_watch_file_invalidates_cache_without_dependency(files):
+    make_pipeline(files, [], watch=[files['model']]).run()
+    pipeline = make_pipeline(files, [], watch=[files['model']])
+    assert pipeline.dependencies('b') == ['a']
+    with open(files['model'], 'w', encoding='utf-8') as f:
+        f.write('模型')
+    assert pipeline.run(['b']) == {'a': 'cached', 'b': 'done'}
+
+
+def test_cycle_is_rejected(files):
+    calls = []
+    stages = [
+        copy_stage('a', files['b'], files['a'], calls),
+        copy_stage('b', files['a'], files['b'], calls),
+    ]
+    pipeline = Pipeline(stages, {}, state_file=files['state'])
+    with pytest.raises(ValueError, match='循环依赖'):
+        pipeline.run()
+    assert calls == []
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from src.progressive_estimate import progressive_estimate, reached_precision
+
+
+def make_comments(sizes, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        '宣传片ID': np.repeat(np.arange(1, len(sizes) + 1), sizes),
+        '评论内容': rng.random(sum(sizes)).astype(str),
+    })
+
+
+def test_reached_precision_requires_min_samples():
+    scored = np.array([10, 30, 5, 40])
+    population = np.array([100, 100, 5, 100])
+    width = np.array([0.001, 0.001, np.nan, 0.5])
+    assert reached_precision(scored, population, width, 0.01, 30).tolist() == [False, True, True, False]
+
+
+def test_flags_match_stopping_rule():
+    # 得分恒定时第一批后半宽就为0，但仍要打满min_samples条才停止
+    df = make_comments([200, 200, 1])
+    estimates, fraction = progressive_estimate(df, '评论内容', lambda texts: np.full(len(texts), 0.5),
+                                               precision=0.1, batch_size=5, min_samples=30)
+    assert estimates['已打分数'].tolist() == [30, 30, 1, 61]
+    assert estimates['达到精度'].all()
+    assert fraction == 61 / 401
+
+
+def test_estimate_close_to_full_mean():
+    df = make_comments([2000, 3000])
+    estimates, fraction = progressive_estimate(df, '评论内容', lambda texts: texts.astype(float).to_numpy(),
+                                               precision=0.02, batch_size=100, min_samples=30)
+    truth = df['评论内容'].astype(float).groupby(df['宣传片ID']).mean()
+    groups = estimates.iloc[:2].set_index('宣传片ID')
+    assert ((groups['均值估计'] - truth).abs() <= 3 * groups['置信区间半宽']).all()
+    assert fraction < 1
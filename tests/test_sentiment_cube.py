@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.sentiment_cube import SentimentCube
+
+DIMENSIONS = ['宣传片ID', '是否AI生成', '景区类型']
+
+
+def make_rows(n, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        '宣传片ID': rng.integers(1, 6, n),
+        '是否AI生成': rng.integers(0, 2, n),
+        '景区所在地': rng.choice(['云南', '四川', '浙江'], n),
+        '景区类型': rng.choice(['自然', '人文'], n),
+        '是否本地评论': rng.integers(0, 2, n),
+        '是否主评论': rng.integers(0, 2, n),
+        '评论时间': rng.choice(['2024-01-01', '2024-01-02'], n),
+        'IP地址': rng.choice(['北京', '上海'], n),
+        '评论内容': rng.choice(['好看', '一般', '想去', '哈哈'], n),  # 大量完全相同的行
+        '情感得分': rng.random(n),
+    })
+
+
+def expected_stats(df, by):
+    grouped = df.assign(**{col: df[col].astype(str) for col in by}).groupby(by)['情感得分']
+    return grouped.agg(数量='size', 均值='mean', 方差='var').reset_index()
+
+
+@pytest.fixture
+def files(tmp_path):
+    return str(tmp_path / '情感立方体.xlsx'), str(tmp_path / 'keys.bin')
+
+
+def open_cube(files):
+    return SentimentCube(*files, dimensions=DIMENSIONS)
+
+
+@pytest.mark.parametrize('by', [['宣传片ID'], ['是否AI生成', '景区类型'], DIMENSIONS])
+def test_query_matches_groupby_across_increments(files, by):
+    first = make_rows(300, 0)
+    full = pd.concat([first, make_rows(200, 1)], ignore_index=True)
+    assert open_cube(files).update(first) == 300
+    # 第二次读入的是追加了新评论后的完整结果，已累加的评论不能重复计入
+    assert open_cube(files).update(full) == 200
+
+    result = open_cube(files).query(by)
+    expected = expected_stats(full, by)
+    pd.testing.assert_frame_equal(result[by + ['数量']], expected[by + ['数量']], check_dtype=False)
+    np.testing.assert_allclose(result['均值'], expected['均值'])
+    np.testing.assert_allclose(result['方差'], expected['方差'])
+
+
+def test_repeated_update_adds_nothing(files):
+    df = make_rows(100, 0)
+    open_cube(files).update(df)
+    assert open_cube(files).update(df) == 0
+
+
+def test_rescored_rows_trigger_rebuild(files):
+    df = make_rows(100, 0)
+    open_cube(files).update(df)
+    rescored = df.assign(情感得分=1 - df['情感得分'])
+
+    cube = open_cube(files)
+    assert cube.update(rescored) == 100
+    np.testing.assert_allclose(cube.query()['均值'], rescored['情感得分'].mean())
+
+
+def test_interrupted_update_is_rebuilt(files):
+    df = make_rows(100, 0)
+    cube = open_cube(files)
+    cube.update(df)
+    # 模拟标识已写入、立方体还没写出时中断
+    more = make_rows(50, 1)
+    with open(cube.keys_file, 'ab') as f:
+        np.array(['0123456789abcdef'], dtype='S16').tofile(f)
+
+    cube = open_cube(files)
+    assert len(cube.keys) == 0
+    full = pd.concat([df, more], ignore_index=True)
+    assert cube.update(full) == 150
+    assert cube.query()['数量'].iloc[0] == 150
+
+
+@pytest.mark.parametrize('more', [0, 50])
+def test_changed_bins_rebuild(files, more):
+    df = make_rows(100, 0)
+    open_cube(files).update(df)
+    full = pd.concat([df, make_rows(more, 1)], ignore_index=True)
+
+    cube = SentimentCube(*files, dimensions=DIMENSIONS, bins=7)
+    assert len(cube.keys) == 0
+    assert cube.update(full) == 100 + more
+    result = SentimentCube(*files, dimensions=DIMENSIONS, bins=7).query()
+    assert result['数量'].iloc[0] == 100 + more
+    assert result[cube.hist_columns].sum(axis=1).iloc[0] == 100 + more
+
+
+def test_interrupted_before_keys_is_rebuilt(files):
+    df = make_rows(100, 0)
+    cube = open_cube(files)
+    cube.update(df)
+    # 模拟立方体和元数据已写出、标识还没追加时中断
+    more = make_rows(50, 1)
+    cube.cube = cube._aggregate(pd.concat([df, more], ignore_index=True), '情感得分')
+    cube.meta = dict(cube.meta, rows=150)
+    cube.save()
+
+    cube = open_cube(files)
+    assert len(cube.keys) == 0
+    assert cube.update(pd.concat([df, more], ignore_index=True)) == 150
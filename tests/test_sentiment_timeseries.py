@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.output_writer import read_table, write_table
+from src.sentiment_timeseries import build_sentiment_timeseries
+
+
+def make_comments(n, seed, max_day=40, videos=4):
+    rng = np.random.default_rng(seed)
+    video = rng.integers(1, videos + 1, n)
+    return pd.DataFrame({
+        '宣传片ID': video,
+        '视频发布时间': pd.Series(video).map(lambda v: f'2024-0{v}-01').values,
+        '评论时间差': rng.integers(-1, max_day + 1, n),
+        '评论内容': [f'评论{seed}-{i}' for i in range(n)],
+        '情感得分': rng.random(n),
+    })
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return {
+        'sentiment': str(tmp_path / '情感分析结果.xlsx'),
+        'output': str(tmp_path / '情感时间序列.xlsx'),
+        'keys': str(tmp_path / 'keys.bin'),
+        'full': str(tmp_path / '全量.xlsx'),
+        'full_keys': str(tmp_path / 'full_keys.bin'),
+    }
+
+
+def run(paths, df, incremental=True):
+    write_table(df, paths['sentiment'])
+    if incremental:
+        return build_sentiment_timeseries(paths['sentiment'], paths['output'], keys_file=paths['keys'])
+    return build_sentiment_timeseries(paths['sentiment'], paths['full'], incremental=False,
+                                      keys_file=paths['full_keys'])
+
+
+def assert_same(paths, incremental, df):
+    full = run(paths, df, incremental=False)
+    pd.testing.assert_frame_equal(incremental.reset_index(drop=True), full.reset_index(drop=True))
+    pd.testing.assert_frame_equal(read_table(paths['output']), read_table(paths['full']))
+
+
+def test_incremental_matches_full_rebuild_with_late_rows(paths):
+    first = make_comments(400, 0, max_day=20)
+    run(paths, first)
+
+    # 第二批：新的日期，以及已有最后一天（通常只采集了一部分）和更早日期上补采的评论
+    last_day = first[first['评论时间差'] > 0].groupby('宣传片ID')['评论时间差'].max()
+    late = make_comments(60, 1, max_day=20)
+    late['评论时间差'] = late['宣传片ID'].map(last_day).values
+    earlier = make_comments(30, 2, max_day=5)
+    df = pd.concat([first, make_comments(300, 3, max_day=40), late, earlier], ignore_index=True)
+
+    assert_same(paths, run(paths, df), df)
+
+
+def test_rescored_rows_are_reaggregated(paths):
+    df = make_comments(300, 0)
+    run(paths, df)
+    rescored = df.copy()
+    rescored.loc[rescored.index[::7], '情感得分'] = 0.5
+
+    assert_same(paths, run(paths, rescored), rescored)
+
+
+def test_unchanged_input_is_stable(paths):
+    df = make_comments(300, 0)
+    first = run(paths, df)
+    pd.testing.assert_frame_equal(run(paths, df), first)
+
+
+def test_no_time_data_is_skipped(paths):
+    df = make_comments(50, 0)
+    df['评论时间差'] = np.nan
+    result = run(paths, df)
+    assert result is not None and result.empty
+
+
+def test_removed_rows_trigger_full_rebuild(paths, capsys):
+    df = make_comments(300, 0)
+    run(paths, df)
+    # 删除部分评论（包括一个视频的全部评论），其余视频没有新评论
+    removed = df[(df.index % 5 != 0) & (df['宣传片ID'] != 2)].reset_index(drop=True)
+
+    result = run(paths, removed)
+    assert '全量重建' in capsys.readouterr().out
+    assert 2 not in set(result['宣传片ID'])
+    assert_same(paths, result, removed)
@@ -0,0 +1,56 @@
+import os
+
+import pandas as pd
+import pytest
+
+from src.output_writer import read_table, write_table
+from src.sentiment_analysis import merge_sentiment_shards, process_excel
+from src.sharding import shard_path
+
+TEXTS = ['风景真美', '太假了', '想去', '哈哈哈', '一般般', 'AI味很重', '下次一定去', '好看', '', '人太多了', '太美了', '想去']
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = str(tmp_path / '添加属性列.xlsx')
+    write_table(pd.DataFrame({
+        '评论内容': TEXTS,
+        '宣传片ID': [i % 4 + 1 for i in range(len(TEXTS))],
+        '是否主评论': [i % 2 for i in range(len(TEXTS))],
+    }), path)
+    return path
+
+
+@pytest.mark.parametrize('shard_key', ['fingerprint', 'video'])
+def test_merged_shards_match_unsharded_run(tmp_path, input_file, shard_key):
+    full_file = str(tmp_path / '全量.xlsx')
+    process_excel(input_file, '评论内容', full_file)
+
+    output_file = str(tmp_path / '情感分析结果.xlsx')
+    for index in range(1, 4):
+        process_excel(input_file, '评论内容', output_file, shard=(index, 3), shard_key=shard_key)
+    merged = merge_sentiment_shards(input_file, '评论内容', output_file, 3)
+
+    assert merged is not None
+    pd.testing.assert_frame_equal(read_table(output_file), read_table(full_file))
+
+
+def test_merge_rejects_missing_shard(tmp_path, input_file):
+    output_file = str(tmp_path / '情感分析结果.xlsx')
+    for index in range(1, 4):
+        process_excel(input_file, '评论内容', output_file, shard=(index, 3))
+    os.remove(shard_path(output_file, (2, 3)))
+
+    assert merge_sentiment_shards(input_file, '评论内容', output_file, 3) is None
+    assert not os.path.exists(output_file)
+
+
+def test_merge_rejects_changed_input(tmp_path, input_file):
+    output_file = str(tmp_path / '情感分析结果.xlsx')
+    for index in range(1, 4):
+        process_excel(input_file, '评论内容', output_file, shard=(index, 3))
+    df = read_table(input_file)
+    df.loc[0, '评论内容'] = '改过的评论'
+    write_table(df, input_file)
+
+    assert merge_sentiment_shards(input_file, '评论内容', output_file, 3) is None
@@ -0,0 +1,55 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+from snownlp import SnowNLP
+
+import src.snownlp_batch as snownlp_batch
+from src.snownlp_batch import get_batch_scorer
+
+TEXTS = [
+    '这个宣传片拍得太美了，一定要去看看',
+    '无聊，浪费时间',
+    '哈哈哈哈哈哈',
+    '[赞R][赞R]好看',
+    'AI做的吧，感觉很假',
+    '景色不错 but 人太多了',
+    '12345',
+    '去过三次了，每次都有新的感受！！',
+    '   前后有空格   ',
+    '还行吧',
+]
+
+
+def test_scores_match_snownlp():
+    scores = get_batch_scorer().score(TEXTS)
+    expected = [SnowNLP(text).sentiments for text in TEXTS]
+    np.testing.assert_allclose(scores, expected, rtol=1e-9, atol=1e-12)
+
+
+def test_empty_and_missing_texts_are_nan():
+    scores = get_batch_scorer().score(['', None, float('nan'), '好'])
+    assert np.isnan(scores[:3]).all()
+    assert scores[3] == pytest.approx(SnowNLP('好').sentiments)
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_segmentation_error_only_fails_that_text(monkeypatch, processes):
+    segment_text = snownlp_batch.segment_text
+
+    def flaky(text):
+        if text == '无聊，浪费时间':
+            raise RuntimeError('分词失败')
+        return segment_text(text)
+
+    monkeypatch.setattr(snownlp_batch, 'segment_text', flaky)
+    errors = []
+    monkeypatch.setattr(snownlp_batch, 'report_error',
+                        lambda log, model, text, e, row=None: errors.append((text, str(e), row)))
+    scores = get_batch_scorer().score(pd.Series(TEXTS, index=range(100, 100 + len(TEXTS))), processes=processes)
+
+    assert errors == [('无聊，浪费时间', '分词失败', 101)]
+    assert math.isnan(scores[1])
+    others = [i for i in range(len(TEXTS)) if i != 1]
+    np.testing.assert_allclose(scores[others], [SnowNLP(TEXTS[i]).sentiments for i in others])
@@ -0,0 +1,69 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+from src.token_cache import TokenCache
+from src.utils import file_lock
+
+
+class CharTokenizer:
+    pad_token_id = 0
+
+    def __call__(self, texts, truncation=True, max_length=512):
+        return {'input_ids': [[ord(c) for c in text][:max_length] for text in texts]}
+
+
+def digest_ends_with_null(text):
+    return hashlib.sha1(text.encode('utf-8')).digest().endswith(b'\x00')
+
+
+def test_keys_ending_with_null_byte_round_trip(tmp_path):
+    texts = [f'评论{i}' for i in range(2000)]
+    assert any(digest_ends_with_null(text) for text in texts)
+    rows = TokenCache(str(tmp_path), CharTokenizer()).encode(texts)
+
+    reopened = TokenCache(str(tmp_path), CharTokenizer())
+    assert len(reopened) == len(texts)
+    np.testing.assert_array_equal(reopened.encode(texts), rows)
+    assert len(reopened) == len(texts)
+    for i in (0, 1999):
+        np.testing.assert_array_equal(reopened.get(rows[i]), [ord(c) for c in texts[i]])
+
+
+def test_open_waits_for_pending_append(tmp_path):
+    writer = TokenCache(str(tmp_path), CharTokenizer())
+    writer.encode(['第一条'])
+    path = writer.cache_path
+    opened = []
+
+    # 另一个进程已写入ids和lengths、还没写keys时打开缓存，不能截掉这条正在写入的记录
+    with file_lock(os.path.join(path, '.lock')):
+        with open(os.path.join(path, 'ids.bin'), 'ab') as f:
+            np.array([ord(c) for c in '第二条'], dtype=np.int32).tofile(f)
+        with open(os.path.join(path, 'lengths.bin'), 'ab') as f:
+            np.array([3], dtype=np.int32).tofile(f)
+        reader = threading.Thread(target=lambda: opened.append(TokenCache(str(tmp_path), CharTokenizer())))
+        reader.start()
+        reader.join(0.5)
+        assert reader.is_alive()
+        with open(os.path.join(path, 'keys.bin'), 'ab') as f:
+            np.array([hashlib.sha1('第二条'.encode('utf-8')).digest()], dtype='S20').tofile(f)
+    reader.join()
+
+    cache = opened[0]
+    assert len(cache) == 2
+    np.testing.assert_array_equal(cache.get(cache.encode(['第二条'])[0]), [ord(c) for c in '第二条'])
+
+
+def test_interleaved_writers_share_cache(tmp_path):
+    first = TokenCache(str(tmp_path), CharTokenizer())
+    second = TokenCache(str(tmp_path), CharTokenizer())
+    first.encode(['甲', '乙'])
+    # second打开时还没有这些记录：追加前会读入first写入的记录，不会重复写入，也不会错位
+    rows = second.encode(['乙', '丙'])
+    assert len(second) == 3
+    for text, row in zip(['乙', '丙'], rows):
+        np.testing.assert_array_equal(second.get(row), [ord(text)])
+    assert len(TokenCache(str(tmp_path), CharTokenizer())) == 3